@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+'''
+Micro-benchmarks for the indexing & hashing hot paths. Each function is timed over synthetic inputs of
+several sizes; results are stored as json per commit & can be compared against an earlier run. A
+per-item cost that grows with input size flags a superlinear (e.g. `in list(dict.keys())`) pattern.
+'''
+from __future__ import print_function
+import os
+import sys
+import json
+import timeit
+import argparse
+import subprocess
+import synthetic_grq
+
+SIZES = [1000, 10000, 100000]
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.benchmarks')
+
+def build_cases(size):
+    '''returns a list of (name, callable) for the given input size'''
+    import excel
+    import missing
+    import gen_ops_report as ops
+    corpus = synthetic_grq.by_type(synthetic_grq.generate_corpus(size, duplicate_rate=0.05))
+    acq_lists = corpus['acq-list']
+    unhashed = [strip_hash(obj) for obj in acq_lists]
+    allowed_hashes = list(set(ops.get_hash(obj) for obj in acq_lists[::2]))
+    acq_list_dct = ops.store_by_hash(acq_lists)
+    slc_dct = ops.store_by_id(corpus['slc'])
+    acq_map = dict((acq['_source']['metadata']['title'], acq['_source']['metadata']['title']) for acq in corpus['acq'])
+    acq_by_slc = ops.store_by_slc_id(corpus['acq'])
+    audit_trail = corpus['audit_trail']
+    return [
+        ('store_by_hash', lambda: ops.store_by_hash(acq_lists)),
+        ('filter_hashes', lambda: list(ops.filter_hashes(acq_lists, allowed_hashes))),
+        ('gen_hash', lambda: [ops.gen_hash(obj) for obj in unhashed]),
+        ('get_hash', lambda: [ops.get_hash(obj) for obj in acq_lists]),
+        ('gen_date_pair', lambda: [ops.gen_date_pair(obj) for obj in acq_lists]),
+        ('sort_into_hash_list', lambda: ops.sort_into_hash_list(acq_list_dct)),
+        ('store_by_gunw', lambda: ops.store_by_gunw(corpus['aoi_track'])),
+        ('excel.build_audit_dict', lambda: excel.build_audit_dict(audit_trail, 'comment')),
+        ('excel.build_audit_index', lambda: excel.build_audit_index(audit_trail)),
+        ('excel.get_missing_slcs', lambda: [excel.get_missing_slcs(obj, acq_map, slc_dct) for obj in acq_lists]),
+        ('missing.find_missing', lambda: missing.find_missing(acq_list_dct.items(), slc_dct.keys(), acq_by_slc)),
+    ]
+
+def strip_hash(obj):
+    '''copy of the object without a full_id_hash, forcing get_hash to generate one'''
+    met = dict(obj['_source']['metadata'])
+    met.pop('full_id_hash', None)
+    src = dict(obj['_source'])
+    src['metadata'] = met
+    return {'_id': obj['_id'], '_source': src}
+
+def run(sizes, repeat):
+    '''returns {function: {size: best seconds}}'''
+    results = {}
+    for size in sizes:
+        for name, func in build_cases(size):
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            results.setdefault(name, {})[str(size)] = best
+            print('{:<28} {:>8} {:>10.4f}s {:>10.2f}us/item'.format(name, size, best, best / size * 1e6))
+    return results
+
+def check_scaling(results, max_growth):
+    '''flags functions whose per-item cost grows more than max_growth between the smallest & largest size'''
+    problems = []
+    for name, timings in sorted(results.items()):
+        sizes = sorted(int(x) for x in timings.keys())
+        if len(sizes) < 2:
+            continue
+        small, large = sizes[0], sizes[-1]
+        growth = (timings[str(large)] / large) / max(timings[str(small)] / small, 1e-12)
+        if growth > max_growth:
+            problems.append('{}: per-item cost grew {:.1f}x from {} to {} items'.format(name, growth, small, large))
+    return problems
+
+def compare(results, previous, tolerance):
+    '''flags functions slower than the previous run by more than tolerance'''
+    problems = []
+    for name, timings in sorted(results.items()):
+        for size, seconds in sorted(timings.items()):
+            before = previous.get('results', {}).get(name, {}).get(size, False)
+            if before and seconds > before * (1.0 + tolerance):
+                problems.append('{}@{}: {:.4f}s vs {:.4f}s at {}'.format(name, size, seconds, before,
+                                                                         previous.get('commit', 'previous run')))
+    return problems
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode('utf8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def main():
+    parser = argparse.ArgumentParser(description='hot path micro-benchmarks')
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=False, help='defaults to .benchmarks/hotpaths-<commit>.json')
+    parser.add_argument('--compare', default=False, help='results json of an earlier commit to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional slowdown vs --compare')
+    parser.add_argument('--max-growth', type=float, default=3.0, help='allowed growth in per-item cost across sizes')
+    args = parser.parse_args()
+    commit = current_commit()
+    results = run(args.sizes, args.repeat)
+    output = args.output
+    if not output:
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        output = os.path.join(RESULTS_DIR, 'hotpaths-{}.json'.format(commit))
+    with open(output, 'w') as outf:
+        json.dump({'commit': commit, 'sizes': args.sizes, 'results': results}, outf, indent=2, sort_keys=True)
+    print('wrote {}'.format(output))
+    problems = check_scaling(results, args.max_growth)
+    if args.compare:
+        with open(args.compare, 'r') as fin:
+            problems.extend(compare(results, json.load(fin), args.tolerance))
+    for problem in problems:
+        print('REGRESSION {}'.format(problem))
+    if problems:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
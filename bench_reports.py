@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+'''
+Scaling benchmarks for the report generators. Runs `generate` from each report module over synthetic
+corpora of increasing size, records wall time, peak RSS & output size, & fails when a result
+regresses past the stored baselines, or has none to compare against.
+'''
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+import synthetic_grq
+
+MODULES = ['gen_ops_report', 'gen_enumeration_report', 'gen_ops_report_email']
+SIZES = [1000, 10000, 100000] # bench_baselines.json holds these, pass --sizes 1000000 after adding its baselines
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baselines.json')
+COMPARED = ['wall_s', 'peak_rss_mb']
+
+def main():
+    parser = argparse.ArgumentParser(description='report scaling benchmarks')
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help='number of acq-lists')
+    parser.add_argument('--baselines', default=BASELINE_FILE)
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional regression')
+    parser.add_argument('--update-baselines', action='store_true', help='store these results as the baselines')
+    parser.add_argument('--output', default=False, help='write the results json here')
+    parser.add_argument('--run-case', nargs=2, metavar=('MODULE', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case[0], int(args.run_case[1]))))
+        return
+    results = {}
+    for size in args.sizes:
+        for module in args.modules:
+            key = '{}:{}'.format(module, size)
+            results[key] = run_isolated(module, size)
+            print('{:<40} {}'.format(key, json.dumps(results[key], sort_keys=True)))
+    if args.output:
+        with open(args.output, 'w') as outf:
+            json.dump(results, outf, indent=2, sort_keys=True)
+    if args.update_baselines:
+        baselines = load_json(args.baselines)
+        baselines.update(results)
+        with open(args.baselines, 'w') as outf:
+            json.dump(baselines, outf, indent=2, sort_keys=True)
+        print('updated baselines in {}'.format(args.baselines))
+        return
+    regressions = compare(results, load_json(args.baselines), args.tolerance)
+    for regression in regressions:
+        print('REGRESSION {}'.format(regression))
+    if regressions:
+        sys.exit(1)
+
+def run_isolated(module, size):
+    '''runs a single case in a fresh interpreter so peak RSS is attributable to it'''
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-case', module, str(size)]
+    output = subprocess.check_output(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+def run_case(module_name, size):
+    '''generates a corpus of the given size & times the module's generate over it'''
+    corpus = synthetic_grq.by_type(synthetic_grq.generate_corpus(size))
+    aoi = corpus['aoi'][0]
+    track = 64
+    fake = None
+    if module_name == 'gen_ops_report_email':
+        # the email report pulls the grey/blacklists from GRQ
+        import fake_grq
+        fake = fake_grq.FakeGRQ({synthetic_grq.INDICES['greylist']: corpus['greylist'],
+                                 synthetic_grq.INDICES['blacklist']: corpus['blacklist']}).start()
+        os.environ['GRQ_ES_URL'] = fake.url
+    module = __import__(module_name)
+    workdir = tempfile.mkdtemp(prefix='bench_reports_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        rss_before = current_rss_mb()
+        start_wall, start_cpu = time.time(), time.process_time()
+        product_id = 'AOI_Bench_Report-{}-TN{}'.format(module_name, track)
+        if module_name == 'gen_enumeration_report':
+            enumeration = ','.join(sorted(set(gen_pair_str(x) for x in corpus['acq-list'][::2])))
+            module.generate(product_id, aoi, track, corpus['acq-list'], corpus['ifg-cfg'], corpus['ifg'],
+                            corpus['audit_trail'], enumeration)
+            output_bytes = dir_size(product_id)
+        elif module_name == 'gen_ops_report_email':
+            html = module.generate(product_id, aoi, track, corpus['acq'], corpus['slc'], corpus['acq-list'],
+                                   corpus['ifg-cfg'], corpus['ifg'], corpus['audit_trail'], corpus['aoi_track'])
+            output_bytes = len(html)
+        else:
+            module.generate(product_id, aoi, track, corpus['acq'], corpus['slc'], corpus['acq-list'],
+                            corpus['ifg-cfg'], corpus['ifg'], corpus['audit_trail'], corpus['aoi_track'])
+            output_bytes = dir_size(product_id)
+        wall, cpu = time.time() - start_wall, time.process_time() - start_cpu
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+        if fake is not None:
+            fake.stop()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return {'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3), 'peak_rss_mb': round(peak_rss, 1),
+            'rss_growth_mb': round(peak_rss - rss_before, 1), 'output_bytes': output_bytes,
+            'acq_lists': len(corpus['acq-list'])}
+
+def compare(results, baselines, tolerance):
+    '''returns a list of human readable regressions past the baselines. Cases without a baseline are
+    reported too, so a missing or stale baselines file can't pass the check'''
+    regressions = []
+    for key in sorted(results.keys()):
+        baseline = baselines.get(key, False)
+        if not baseline:
+            regressions.append('{}: no baseline to compare against, store one with --update-baselines'.format(key))
+            continue
+        for metric in COMPARED:
+            limit = baseline.get(metric, 0) * (1.0 + tolerance)
+            if baseline.get(metric, 0) > 0 and results[key].get(metric, 0) > limit:
+                regressions.append('{} {}: {} > baseline {} (+{:.0%})'.format(key, metric, results[key][metric],
+                                                                              baseline[metric], tolerance))
+    return regressions
+
+def gen_pair_str(acq_list):
+    '''YYYYmmdd-YYYYmmdd string from an acq-list's reference/secondary dates'''
+    met = acq_list['_source']['metadata']
+    return '{}-{}'.format(met['reference_date'][:10].replace('-', ''), met['secondary_date'][:10].replace('-', ''))
+
+def current_rss_mb():
+    '''resident set size of this process right now'''
+    try:
+        with open('/proc/self/statm', 'r') as fin:
+            pages = int(fin.read().split()[1])
+        return pages * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def dir_size(path):
+    '''total bytes of the files under path'''
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def load_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as fin:
+        return json.load(fin)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+'''
+Numeric date pairs for the enumeration report. A date pair is held as the int32 day numbers (days since
+1970-01-01) of its reference (later) & secondary (earlier) dates, packed into one int64 key that sorts
+like the YYYYMMDD-YYYYMMDD string, so the pairs of the audit trail, acq-lists & input enumeration are
+compared with numpy set operations. Strings are only formatted when the sheets are written.
+expected_pairs derives the pairing the enumerator should produce from a track's acquisition dates.
+'''
+from __future__ import print_function
+import os
+import re
+import datetime
+import numpy as np
+import dateutil.parser
+
+# expected pairing settings. Overridden by REPORT_<KEY> environment variables & then by the same keys in _context.json
+SETTINGS = {
+    'expected_pairs': False, # compare against the pairs derived from the track's acquisition dates
+    'expected_neighbors': 3, # pair each acquisition date with this many nearest earlier dates
+    'expected_max_baseline': 0, # drop nearest neighbor pairs spanning more days than this (0 keeps all)
+    'expected_baselines': '', # comma separated temporal baselines in days, eg. 6,12,24, also paired when both dates exist
+}
+EPOCH = np.datetime64('1970-01-01', 'D')
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def configure(ctx=None):
+    '''applies environment & context overrides to SETTINGS'''
+    ctx = ctx or {}
+    for key, default in list(SETTINGS.items()):
+        value = ctx.get(key, os.environ.get('REPORT_{}'.format(key.upper()), None))
+        if value is None or value == '':
+            continue
+        if isinstance(default, bool):
+            value = str(value).lower() in ['true', '1', 'yes']
+        elif isinstance(default, int):
+            value = int(value)
+        SETTINGS[key] = value
+    return SETTINGS
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+COMPACT_DATE = re.compile(r'^\d{8}(T|$)')
+
+def iso_date(value):
+    '''returns the YYYY-MM-DD of a date string, or NaT if it is missing or can't be parsed. ISO &
+    YYYYMMDD dates are sliced, anything else goes through dateutil'''
+    if not value:
+        return 'NaT'
+    value = str(value).strip()
+    if ISO_DATE.match(value):
+        return value[:10]
+    if COMPACT_DATE.match(value):
+        return '{}-{}-{}'.format(value[:4], value[4:6], value[6:8])
+    try:
+        return dateutil.parser.parse(value).strftime('%Y-%m-%d')
+    except (ValueError, OverflowError):
+        return 'NaT'
+
+def to_days(values):
+    '''int32 day numbers of the date strings, -1 where missing or unparseable'''
+    days = np.array([iso_date(value) for value in values], dtype='datetime64[D]')
+    return np.where(np.isnat(days), -1, (days - EPOCH).astype(np.int64)).astype(np.int32)
+
+def pack(first_days, second_days):
+    '''int64 keys of the pairs of day numbers, in either order. -1 for pairs missing a date'''
+    first_days = np.asarray(first_days, dtype=np.int64)
+    second_days = np.asarray(second_days, dtype=np.int64)
+    reference = np.maximum(first_days, second_days)
+    secondary = np.minimum(first_days, second_days)
+    return np.where(secondary < 0, -1, (reference << 32) | secondary)
+
+def unpack(keys):
+    '''reference & secondary day numbers of the keys'''
+    keys = np.asarray(keys, dtype=np.int64)
+    return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32)
+
+def format_pairs(keys):
+    '''YYYYMMDD-YYYYMMDD strings of the keys, empty for pairs missing a date'''
+    keys = np.asarray(keys, dtype=np.int64)
+    reference, secondary = unpack(np.maximum(keys, 0))
+    reference = (EPOCH + reference.astype('timedelta64[D]')).astype(str)
+    secondary = (EPOCH + secondary.astype('timedelta64[D]')).astype(str)
+    return ['{}-{}'.format(ref.replace('-', ''), sec.replace('-', '')) if key >= 0 else ''
+            for key, ref, sec in zip(keys.tolist(), reference, secondary)]
+
+def object_keys(objs):
+    '''
+    keys of the objects' date pairs: the metadata reference & secondary dates, else the start & end
+    times. A single known date pairs with itself
+    '''
+    firsts = []
+    seconds = []
+    for obj in objs:
+        src = obj.get('_source', {})
+        met = src.get('metadata', {})
+        first = met.get('secondary_date', False) or False
+        second = met.get('reference_date', False) or False
+        if first is False and second is False:
+            first = src.get('starttime', False)
+            second = src.get('endtime', False)
+        firsts.append(first or second)
+        seconds.append(second or first)
+    return pack(to_days(firsts), to_days(seconds))
+
+def bucket(objs):
+    '''returns the sorted unique keys of the objects' date pairs & a dict of key -> the objects with that
+    date pair, in input order. Objects without a date pair are skipped'''
+    objs = list(objs)
+    keys = object_keys(objs)
+    buckets = {}
+    for key, obj in zip(keys.tolist(), objs):
+        if key < 0:
+            print('unable to determine the date pair of {}. skipping.'.format(obj.get('_id', '')))
+            continue
+        buckets.setdefault(key, []).append(obj)
+    return np.array(sorted(buckets), dtype=np.int64), buckets
+
+def day_number(value):
+    '''day number of a fixed format YYYYMMDD or YYYY-MM-DD date, None if it isn't one. Sliced into
+    ints rather than parsed, for enumerations of many thousands of pairs'''
+    if len(value) == 8 and value.isdigit():
+        year, month, day = value[:4], value[4:6], value[6:]
+    elif len(value) == 10 and value[4] == '-' and value[7] == '-':
+        year, month, day = value[:4], value[5:7], value[8:]
+    else:
+        return None
+    try:
+        return datetime.date(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+    except ValueError:
+        return None
+
+def parse_pair(value):
+    '''key of a date pair (either order, - or _ separated), None if it can't be parsed. YYYYMMDD &
+    YYYY-MM-DD (with _) pairs are sliced, any other pair of dates, eg. YYmmdd-YYmmdd, goes through dateutil'''
+    value = value.strip().strip('"\'')
+    first = second = None
+    if len(value) == 17 and value[8] in '-_':
+        first, second = day_number(value[:8]), day_number(value[9:])
+    elif len(value) == 21 and value[10] in '-_':
+        first, second = day_number(value[:10]), day_number(value[11:])
+    if first is None or second is None:
+        first, second = parse_dates(value)
+    if first is None or second is None:
+        return None
+    return (max(first, second) << 32) | min(first, second)
+
+def parse_dates(value):
+    '''day numbers of the two - or _ separated dates of the value, parsed by dateutil. None, None if
+    there aren't exactly two'''
+    dates = value.replace('_', '-').split('-')
+    if len(dates) != 2 or not all(dates):
+        return None, None
+    try:
+        first, second = [dateutil.parser.parse(date).date().toordinal() - EPOCH_ORDINAL for date in dates]
+    except (ValueError, OverflowError):
+        return None, None
+    return first, second
+
+def parse_enumeration(date_pairs):
+    '''returns the sorted unique keys of date pair strings (YYYYMMDD-YYYYMMDD or see parse_pair, either order)'''
+    keys = []
+    for date_pair in date_pairs:
+        key = parse_pair(date_pair)
+        if key is None:
+            print('Failed parsing date pair: {}. skipping.'.format(date_pair))
+            continue
+        keys.append(key)
+    return np.unique(np.array(keys, dtype=np.int64))
+
+def expected_pairs(days, neighbors=None, max_baseline=None, baselines=None):
+    '''
+    returns the sorted unique keys of the pairs expected from the acquisition day numbers: every date with
+    its nearest `neighbors` earlier dates no more than `max_baseline` days back (0 for any), plus every
+    two dates `baselines` (list or comma separated days) apart. Defaults to SETTINGS
+    '''
+    neighbors = SETTINGS['expected_neighbors'] if neighbors is None else neighbors
+    max_baseline = SETTINGS['expected_max_baseline'] if max_baseline is None else max_baseline
+    baselines = SETTINGS['expected_baselines'] if baselines is None else baselines
+    if not isinstance(baselines, (list, tuple)):
+        baselines = [x for x in str(baselines).split(',') if x.strip()]
+    dates = np.unique(np.asarray(days, dtype=np.int64))
+    dates = dates[dates >= 0]
+    keys = [np.array([], dtype=np.int64)]
+    for offset in range(1, min(int(neighbors), len(dates) - 1) + 1):
+        reference, secondary = dates[offset:], dates[:-offset]
+        if max_baseline:
+            keep = reference - secondary <= int(max_baseline)
+            reference, secondary = reference[keep], secondary[keep]
+        keys.append(pack(reference, secondary))
+    for baseline in baselines:
+        reference = dates[np.isin(dates - int(baseline), dates)]
+        keys.append(pack(reference, reference - int(baseline)))
+    return np.unique(np.concatenate(keys))
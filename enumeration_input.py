@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+'''
+Bulk input enumeration for the enumeration report. Date pairs are read from a local file, file://, http(s)://
+or s3:// path, newline delimited or CSV & optionally gzipped, a line at a time, so enumerations too large for
+the submitter text field are never held as one string. Lines that can't be parsed are reported with their
+line numbers & skipped. Setting s3_endpoint serves s3://bucket/key paths from <s3_endpoint>/bucket/key over
+plain HTTP, so a local stand-in can be used instead of S3.
+'''
+from __future__ import print_function
+import io
+import os
+import gzip
+from array import array
+import requests
+import numpy as np
+import date_pairs
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+
+SETTINGS = {'s3_endpoint': '', 'max_reported_lines': 20} # bad lines printed before only counting them
+GZIP_MAGIC = b'\x1f\x8b'
+
+def configure(ctx=None):
+    '''applies environment & context overrides to SETTINGS'''
+    ctx = ctx or {}
+    for key, default in list(SETTINGS.items()):
+        value = ctx.get(key, os.environ.get('REPORT_{}'.format(key.upper()), None))
+        if value is None or value == '':
+            continue
+        SETTINGS[key] = int(value) if isinstance(default, int) else value
+    return SETTINGS
+
+def read(path):
+    '''returns the sorted unique date pair keys (see date_pairs) of the file at path & the number of bad lines'''
+    stream = open_path(path)
+    try:
+        keys, bad = parse_lines(stream)
+    finally:
+        stream.close()
+    print('read {} date pairs from {}, skipped {} bad lines'.format(len(keys), path, bad))
+    return keys, bad
+
+def parse_lines(lines):
+    '''
+    parses the date pairs of the lines. A line holds comma separated pairs (YYYYMMDD-YYYYMMDD), or a pair
+    as two date columns (YYYYMMDD or YYYY-MM-DD). Blank lines, # comments & a header line are skipped.
+    Returns the sorted unique keys & the number of bad lines
+    '''
+    keys = array('q')
+    bad = 0
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line_number == 1 and not any(char.isdigit() for char in line):
+            continue # csv header
+        line_keys = parse_line(line)
+        if line_keys is None:
+            bad += 1
+            if bad <= SETTINGS['max_reported_lines']:
+                print('line {}: unable to parse date pairs from: {}'.format(line_number, line[:200]))
+            continue
+        keys.extend(line_keys)
+    if bad > SETTINGS['max_reported_lines']:
+        print('... {} more bad lines not shown'.format(bad - SETTINGS['max_reported_lines']))
+    return np.unique(np.frombuffer(keys, dtype=np.int64) if keys else np.array([], dtype=np.int64)), bad
+
+def parse_line(line):
+    '''returns the keys of the pairs of a line, None if any field is unparseable'''
+    fields = [field.strip().strip('"\'') for field in line.split(',')]
+    fields = [field for field in fields if field]
+    if len(fields) == 2:
+        days = [date_pairs.day_number(field) for field in fields]
+        if days[0] is not None and days[1] is not None:
+            return [int(date_pairs.pack(days[0], days[1]))]
+    keys = [date_pairs.parse_pair(field) for field in fields]
+    if not keys or None in keys:
+        return None
+    return keys
+
+def open_path(path):
+    '''opens the path as a stream of text lines, decompressing it if it is gzipped'''
+    if path.startswith('s3://'):
+        return open_url(s3_url(path))
+    if path.startswith('http://') or path.startswith('https://'):
+        return open_url(path)
+    if path.startswith('file://'):
+        path = path[len('file://'):]
+    return text_lines(io.open(path, 'rb'))
+
+def open_url(url):
+    response = requests.get(url, stream=True, timeout=60, verify=False)
+    response.raise_for_status()
+    response.raw.decode_content = True # undo any Content-Encoding, a .gz body is detected by its magic bytes
+    response.raw.auto_close = False # reads past the end of the body return b'' rather than failing
+    return text_lines(io.BufferedReader(response.raw))
+
+def s3_url(path):
+    '''http url of an s3://bucket/key path, on the s3_endpoint stand-in or presigned with boto3'''
+    bucket, _, key = path[len('s3://'):].partition('/')
+    if SETTINGS['s3_endpoint']:
+        return '{}/{}/{}'.format(SETTINGS['s3_endpoint'].rstrip('/'), bucket, key)
+    if boto3 is None:
+        raise Exception('boto3 is required to read {}. Install it or set s3_endpoint'.format(path))
+    return boto3.client('s3').generate_presigned_url('get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=3600)
+
+def text_lines(raw):
+    '''wraps a buffered binary stream as text lines, gunzipping it if it starts with the gzip magic bytes'''
+    if raw.peek(2)[:2] == GZIP_MAGIC:
+        raw = gzip.GzipFile(fileobj=raw, mode='rb')
+    return io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
@@ -4,12 +4,32 @@
 Contains functions for writing Excel files for the Standard Product Report
 '''
 from __future__ import print_function
+import os
 import re
 import json
 import pickle
 import hashlib
 from openpyxl import Workbook
 import dateutil.parser
+import date_pairs
+
+# Audit Trail sheet settings. Overridden by REPORT_<KEY> environment variables & then by the same keys in _context.json
+SETTINGS = {
+    'audit_columns': '', # comma separated metadata keys written to the Audit Trail sheet, all but EXCLUDED_AUDIT_COLUMNS if empty
+    'audit_cell_chars': 32767, # json values are truncated to this many characters, excel's cell limit
+}
+EXCLUDED_AUDIT_COLUMNS = ['union_geojson', 'context']
+AUDIT_FIELDS = ['comment', 'failure_reason'] # audit trail fields looked up by date pair
+
+def configure(ctx=None):
+    '''applies environment & context overrides to SETTINGS'''
+    ctx = ctx or {}
+    for key, default in list(SETTINGS.items()):
+        value = ctx.get(key, os.environ.get('REPORT_{}'.format(key.upper()), None))
+        if value is None or value == '':
+            continue
+        SETTINGS[key] = int(value) if isinstance(default, int) else value
+    return SETTINGS
 
 def generate(aoi, track, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trail, enumeration=False):
     '''ingests the various products and stages them by track for generating worksheets'''
@@ -130,20 +150,12 @@ def generate_track(track, aoi, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trai
         ws7.append([slc_id, slc_st, slc_et, acq_list, ifg_cfg])
     #audit trail
     ws8 = wb.create_sheet('Audit Trail')
-    #just write all keys
-    title_row = list(audit_trail[0].get('_source', {}).get('metadata', {}).keys())
-    for x in ['union_geojson', 'context']:
-        title_row.remove(x)
+    title_row = audit_columns(audit_trail)
     ws8.append(title_row)
+    max_chars = SETTINGS['audit_cell_chars']
     for element in audit_trail:
         met = element.get('_source', {}).get('metadata', {})
-        publish_row = []
-        for key in title_row:
-            val = met.get(key, '')
-            if not isinstance(val, str):
-                val = json.dumps(val)
-            publish_row.append(val)
-        ws8.append(publish_row)
+        ws8.append([cell_value(met.get(key, ''), max_chars) for key in title_row])
     ws9 = wb.create_sheet('Acquisition-Lists')
     title_row = ['acq-list id', 'master_scenes', 'slave_scenes', 'master_orbit_file', 'slave_orbit_file']
     ws9.append(title_row)
@@ -169,48 +181,73 @@ def generate_track(track, aoi, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trai
     ws11 = wb.create_sheet('Enumeration Comparison')
     title_row = ['Unique Date Pair', 'In Input Enumeration?', 'In HySDS Enumeration?', 'Reason HySDS Skipped', 'Audit Comment', 'Reference Failure']
     ws11.append(title_row)
-    alg_date_pairs = all_date_pairs
-    human_date_pairs = enumeration
-    total_date_pairs = sorted(list(set(alg_date_pairs + human_date_pairs)))
-    comment_dict = build_audit_dict(audit_trail, 'comment')
-    failure_dict = build_audit_dict(audit_trail, 'failure_reason')
+    alg_date_pairs = set(all_date_pairs)
+    human_date_pairs = set(enumeration)
+    total_date_pairs = sorted(alg_date_pairs | human_date_pairs)
+    audit_index = build_audit_index(audit_trail)
     for date_pair in total_date_pairs:
-        in_human_enumeration = False
-        if date_pair in human_date_pairs:
-            in_human_enumeration = True
-        in_alg_enumeration = False
-        if date_pair in alg_date_pairs:
-            in_alg_enumeration = True
-        comment = comment_dict.get(date_pair, '')
-        failure_reason = failure_dict.get(date_pair, '')
-        ref_failure = failure_dict.get(date_pair[:8], '')
-        ws11.append([date_pair, in_human_enumeration, in_alg_enumeration, failure_reason, comment, ref_failure])
+        in_human_enumeration = date_pair in human_date_pairs
+        in_alg_enumeration = date_pair in alg_date_pairs
+        audit = audit_index.get(date_pair, {})
+        ref_failure = audit_index.get(date_pair[:8], {}).get('failure_reason', '')
+        ws11.append([date_pair, in_human_enumeration, in_alg_enumeration, audit.get('failure_reason', ''), audit.get('comment', ''), ref_failure])
     wb.save(filename)
  
 
-def build_audit_dict(audit_trail, field):
-    '''builds a dict that goes by YMD-YMD as key which returns the metadata field desired'''
-    obj_dict = {}
+def build_audit_index(audit_trail, fields=None):
+    '''
+    indexes the audit trail in one pass by YMD-YMD date pair & by YMD reference date. Each key maps to a dict
+    of the fields (AUDIT_FIELDS by default), holding the first non-empty value of each field for that key.
+    Dates are sliced from ISO/YYYYMMDD strings, falling back to dateutil, & 00000000 if unparseable.
+    '''
+    fields = fields or AUDIT_FIELDS
+    index = {}
     for element in audit_trail:
         met = element.get('_source', {}).get('metadata', {})
-        #st = dateutil.parser.parse(met.get('starttime'))
-        #et = dateutil.parser.parse(met.get('endtime'))
-        #st_str = dateutil.parser.parse(st)
-        try:
-            reference_date = dateutil.parser.parse(met.get('reference_date', False)).strftime('%Y%m%d')
-        except:
-            reference_date = '00000000'
-        try:
-            secondary_date = dateutil.parser.parse(met.get('secondary_date', False)).strftime('%Y%m%d')
-        except:
-            secondary_date = '00000000'
+        reference_date = audit_date(met.get('reference_date', False))
+        secondary_date = audit_date(met.get('secondary_date', False))
         dt_str = '{}-{}'.format(reference_date, secondary_date)
-        field_result = met.get(field, '')
-        if obj_dict.get(dt_str, '') == '':
-            obj_dict[dt_str] = field_result
-        if obj_dict.get(reference_date, '') == '':
-            obj_dict[reference_date] = field_result
-    return obj_dict
+        for key in (dt_str, reference_date):
+            entry = index.setdefault(key, {})
+            for field in fields:
+                if entry.get(field, '') == '':
+                    entry[field] = met.get(field, '')
+    return index
+
+def build_audit_dict(audit_trail, field):
+    '''builds a dict that goes by YMD-YMD as key which returns the metadata field desired'''
+    return dict((key, entry[field]) for key, entry in build_audit_index(audit_trail, [field]).items())
+
+def audit_date(value):
+    '''YYYYMMDD of an audit trail date, 00000000 if it is missing or can't be parsed'''
+    value = date_pairs.iso_date(value)
+    if value == 'NaT':
+        return '00000000'
+    return value.replace('-', '')
+
+def audit_columns(audit_trail):
+    '''the metadata keys of the Audit Trail sheet: the audit_columns setting, else the keys of the first audit
+    trail element less EXCLUDED_AUDIT_COLUMNS'''
+    if SETTINGS['audit_columns']:
+        return [key.strip() for key in SETTINGS['audit_columns'].split(',') if key.strip()]
+    keys = audit_trail[0].get('_source', {}).get('metadata', {}).keys()
+    return [key for key in keys if key not in EXCLUDED_AUDIT_COLUMNS]
+
+def cell_value(val, max_chars):
+    '''the cell text of a metadata value. Non-string values are json encoded, scalars directly & lists/dicts
+    incrementally, stopping once max_chars are encoded'''
+    if isinstance(val, str):
+        return val
+    if val is None or isinstance(val, (bool, int, float)):
+        return json.dumps(val)
+    chunks = []
+    length = 0
+    for chunk in json.JSONEncoder().iterencode(val):
+        chunks.append(chunk)
+        length += len(chunk)
+        if length > max_chars:
+            return ''.join(chunks)[:max(0, max_chars - 3)] + '...'
+    return ''.join(chunks)
 
 def in_dict(hsh, dct):
     '''returns true if the hash input is a key in the input dict'''
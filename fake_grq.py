@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+'''
+In-process stand-in for the GRQ Elasticsearch proxy. Serves /es/<index>/_search (including scrolls),
+/es/<index>/_count, _cat/indices & _alias for the query shapes the report scripts emit, so their real
+requests code paths can be exercised & benchmarked without a cluster.
+'''
+from __future__ import print_function
+import re
+import json
+import time
+import gzip
+import uuid
+import zlib
+import fnmatch
+import argparse
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+SEARCH_REG = re.compile(r'^/es/([^/]+)/_search/?$')
+COUNT_REG = re.compile(r'^/es/([^/]+)/_count/?$')
+SCROLL_REG = re.compile(r'^/es/_search/scroll/?$')
+CAT_INDICES_REG = re.compile(r'^/es/_cat/indices/?([^/]*)$')
+ALIAS_REG = re.compile(r'^/es/([^/]+)/_alias/?$')
+
+class FakeGRQ(object):
+    '''
+    Holds documents by index name & serves them over HTTP. Documents are ES hits
+    ({'_id':..., '_source':...}). latency is the seconds slept per request, max_page_size
+    clamps the requested size & max_result_window rejects deep pages the way ES does. Closed indices
+    are skipped by wildcards & rejected when named, as ES does.
+    '''
+    def __init__(self, documents=None, latency=0.0, max_page_size=None, max_result_window=None,
+                 host='127.0.0.1', port=0):
+        self.indices = {}
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.max_result_window = max_result_window
+        self.closed = set() # names of closed indices
+        self.host = host
+        self.port = port
+        self.requests = [] #list of (path, query) tuples in arrival order
+        self.bytes_sent = 0
+        self.scrolls = {} #scroll id -> [hits, position, size, opening query]
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        for index, docs in list((documents or {}).items()):
+            self.add(index, docs)
+
+    def add(self, index, docs):
+        '''adds the list of documents to the given index'''
+        hits = self.indices.setdefault(index, [])
+        for doc in docs:
+            hit = dict(doc)
+            hit.setdefault('_index', index)
+            hit.setdefault('_type', index)
+            hits.append(hit)
+
+    def load(self, path):
+        '''loads a corpus file of the form {index_name: [hits]}'''
+        with open(path, 'r') as fin:
+            corpus = json.load(fin)
+        for index, docs in list(corpus.items()):
+            self.add(index, docs)
+
+    @property
+    def url(self):
+        '''base url to use as GRQ_ES_URL'''
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        '''starts serving on a background thread'''
+        self._server = _ThreadingServer((self.host, self.port), _build_handler(self))
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''shuts the server down'''
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def resolve(self, index_expr, closed=False):
+        '''returns the index names matching the comma separated, wildcarded index expression. Wildcards
+        only match open indices unless closed is set, & naming a closed index raises'''
+        matched = []
+        for pattern in index_expr.split(','):
+            if pattern in self.closed and not closed:
+                raise ValueError('index_closed_exception: closed index [{}]'.format(pattern))
+            for index in sorted(self.indices.keys()):
+                if index in self.closed and not closed:
+                    continue
+                if fnmatch.fnmatchcase(index, pattern) and index not in matched:
+                    matched.append(index)
+        return matched
+
+    def find(self, index_expr, es_query):
+        '''returns all hits in the matching indices that satisfy the query'''
+        query = self.inline_shapes(es_query.get('query', {'match_all': {}}))
+        hits = []
+        for index in self.resolve(index_expr):
+            hits.extend([dict(hit, _index=index) for hit in self.indices[index] if matches(hit, query)])
+        return hits
+
+    def inline_shapes(self, query):
+        '''replaces indexed_shape references in the query with the referenced document's shape'''
+        if isinstance(query, list):
+            return [self.inline_shapes(x) for x in query]
+        if not isinstance(query, dict):
+            return query
+        if 'indexed_shape' in query:
+            ref = query['indexed_shape']
+            docs = [hit for index in self.resolve(ref['index']) for hit in self.indices[index] if hit.get('_id') == ref['id']]
+            if not docs:
+                raise ValueError('indexed shape [{}] not found in [{}]'.format(ref['id'], ref['index']))
+            return {'shape': get_field(docs[0], ref.get('path', 'location'))}
+        return dict((key, self.inline_shapes(value)) for key, value in query.items())
+
+    def count(self, index_expr, es_query):
+        return {'count': len(self.find(index_expr, es_query)), '_shards': {'total': 1, 'successful': 1, 'failed': 0}}
+
+    def scroll(self, scroll_id=None, index_expr=None, es_query=None):
+        '''opens a scroll (index_expr & es_query given) or returns the next batch of an open one'''
+        if scroll_id is None:
+            size = int(es_query.get('size', 10))
+            if self.max_page_size is not None:
+                size = min(size, self.max_page_size)
+            scroll_id = uuid.uuid4().hex
+            hits = self.find(index_expr, es_query)
+            if 'slice' in es_query:
+                slice_id, slices = int(es_query['slice']['id']), int(es_query['slice']['max'])
+                hits = [hit for hit in hits if zlib.crc32(hit['_id'].encode('utf8')) % slices == slice_id]
+            self.scrolls[scroll_id] = [hits, 0, size, es_query]
+        if scroll_id not in self.scrolls:
+            raise ValueError('No search context found for id [{}]'.format(scroll_id))
+        hits, position, size, opening_query = self.scrolls[scroll_id]
+        self.scrolls[scroll_id][1] = position + size
+        page = [project(hit, opening_query) for hit in hits[position:position + size]]
+        return {'_scroll_id': scroll_id, 'took': 1, 'timed_out': False,
+                'hits': {'total': len(hits), 'max_score': 1.0, 'hits': page}}
+
+    def search(self, index_expr, es_query):
+        '''evaluates the query against the matching indices & returns the ES response dict'''
+        hits = self.find(index_expr, es_query)
+        start = int(es_query.get('from', 0))
+        size = int(es_query.get('size', 10))
+        if self.max_page_size is not None:
+            size = min(size, self.max_page_size)
+        if self.max_result_window is not None and start + size > self.max_result_window:
+            raise ValueError('Result window is too large, from + size must be less than or equal '
+                             'to: [{}] but was [{}]'.format(self.max_result_window, start + size))
+        page = [project(hit, es_query) for hit in hits[start:start + size]]
+        response = {'took': 1, 'timed_out': False, 'hits': {'total': len(hits), 'max_score': 1.0, 'hits': page}}
+        aggs = es_query.get('aggs', es_query.get('aggregations', None))
+        if aggs:
+            response['aggregations'] = aggregate(hits, aggs)
+        return response
+
+    def record(self, path, es_query, nbytes):
+        with self._lock:
+            self.requests.append((path, es_query))
+            self.bytes_sent += nbytes
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _build_handler(fake):
+    '''builds the request handler class bound to the given FakeGRQ'''
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            body = self.rfile.read(length) if length else b''
+            self._respond(body)
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if CAT_INDICES_REG.match(path):
+                # like ES, _cat/indices lists closed indices too, with their status when h=index,status
+                with_status = 'status' in self.path.partition('?')[2]
+                text = ''.join('{}\n'.format('{} {}'.format(idx, 'close' if idx in fake.closed else 'open') if with_status else idx)
+                               for idx in fake.resolve(CAT_INDICES_REG.match(path).group(1) or '*', closed=True))
+                return self._send(200, text, path, content_type='text/plain; charset=UTF-8')
+            if ALIAS_REG.match(path):
+                indices = fake.resolve(ALIAS_REG.match(path).group(1))
+                return self._send(200, dict((idx, {'aliases': {}}) for idx in indices), path)
+            self.do_POST()
+
+        def do_DELETE(self):
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            body = json.loads(self.rfile.read(length).decode('utf8')) if length else {}
+            for scroll_id in body.get('scroll_id', []):
+                fake.scrolls.pop(scroll_id, None)
+            self._send(200, {'succeeded': True})
+
+        def _respond(self, body):
+            if fake.latency:
+                time.sleep(fake.latency)
+            path, _, query_string = self.path.partition('?')
+            try:
+                es_query = json.loads(body.decode('utf8')) if body else {}
+                if SCROLL_REG.match(path):
+                    result = fake.scroll(scroll_id=es_query.get('scroll_id'))
+                elif COUNT_REG.match(path):
+                    result = fake.count(COUNT_REG.match(path).group(1), es_query)
+                elif SEARCH_REG.match(path) and 'scroll=' in query_string:
+                    result = fake.scroll(index_expr=SEARCH_REG.match(path).group(1), es_query=es_query)
+                elif SEARCH_REG.match(path):
+                    result = fake.search(SEARCH_REG.match(path).group(1), es_query)
+                else:
+                    return self._send(404, {'error': 'no handler found for uri [{}]'.format(self.path)})
+            except ValueError as err:
+                return self._send(500, {'error': str(err)}, path, body)
+            return self._send(200, result, path, es_query)
+
+        def _send(self, status, payload, path=None, es_query=None, content_type='application/json; charset=UTF-8'):
+            data = payload.encode('utf8') if content_type.startswith('text/') else json.dumps(payload).encode('utf8')
+            gzipped = 'gzip' in self.headers.get('Accept-Encoding', '') and len(data) > 1024
+            if gzipped:
+                data = gzip.compress(data)
+            fake.record(path or self.path, es_query, len(data))
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def matches(hit, query):
+    '''returns True if the hit satisfies the (subset of the) ES query dsl the reports use'''
+    if not query:
+        return True
+    for key, value in list(query.items()):
+        if key == 'match_all':
+            continue
+        elif key == 'filtered':
+            if not matches(hit, value.get('query', {})) or not matches(hit, value.get('filter', {})):
+                return False
+        elif key == 'bool':
+            if not all(matches(hit, sub) for sub in value.get('must', [])):
+                return False
+            if any(matches(hit, sub) for sub in value.get('must_not', [])):
+                return False
+            should = value.get('should', [])
+            if should and not any(matches(hit, sub) for sub in should):
+                return False
+        elif key == 'term':
+            field, expected = list(value.items())[0]
+            if isinstance(expected, dict):
+                expected = expected.get('value')
+            if not _term_matches(get_field(hit, field), expected):
+                return False
+        elif key == 'range':
+            field, bounds = list(value.items())[0]
+            if not _in_range(get_field(hit, field), bounds):
+                return False
+        elif key == 'geo_shape':
+            field, params = list(value.items())[0]
+            if not shapes_intersect(get_field(hit, field), params.get('shape')):
+                return False
+        else:
+            raise ValueError('unsupported query clause: {}'.format(key))
+    return True
+
+def aggregate(hits, aggs):
+    '''evaluates daily date_histogram aggregations over the hits'''
+    results = {}
+    for name, agg in list(aggs.items()):
+        histogram = agg.get('date_histogram', None)
+        interval = histogram and histogram.get('interval', histogram.get('calendar_interval', histogram.get('fixed_interval')))
+        if histogram is None or interval not in ['day', '1d']:
+            raise ValueError('unsupported aggregation: {}'.format(json.dumps(agg)))
+        counts = {}
+        for hit in hits:
+            value = get_field(hit, histogram.get('field'))
+            if value:
+                day = str(value)[:10]
+                counts[day] = counts.get(day, 0) + 1
+        results[name] = {'buckets': [{'key_as_string': day, 'doc_count': counts[day]} for day in sorted(counts)
+                                     if counts[day] >= histogram.get('min_doc_count', 0)]}
+    return results
+
+def get_field(hit, field):
+    '''returns the value at the dotted field path, looking in _source first. Drops .raw suffixes'''
+    if field == '_id':
+        return hit.get('_id')
+    if field.endswith('.raw'):
+        field = field[:-4]
+    obj = hit.get('_source', {})
+    for part in field.split('.'):
+        if not isinstance(obj, dict) or part not in obj:
+            return None
+        obj = obj.get(part)
+    return obj
+
+def project(hit, es_query):
+    '''returns the hit as ES would for the query's fields list (fields replace _source) or _source includes'''
+    fields = es_query.get('fields', None)
+    includes = es_query.get('_source', None)
+    if isinstance(includes, dict):
+        includes = includes.get('includes', includes.get('include', None))
+    if isinstance(includes, list):
+        hit = dict(hit, _source=filter_source(hit.get('_source', {}), includes))
+    if fields is None:
+        return hit
+    out = dict((k, v) for k, v in list(hit.items()) if k != '_source')
+    out['fields'] = {}
+    for field in fields:
+        value = get_field(hit, field)
+        if value is None:
+            continue
+        out['fields'][field] = value if isinstance(value, list) else [value]
+    return out
+
+def filter_source(source, includes):
+    '''returns the parts of the _source at the dotted include paths (a trailing .* includes the whole object)'''
+    out = {}
+    for path in includes:
+        keys = path[:-2].split('.') if path.endswith('.*') else path.split('.')
+        value = source
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = out
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = value
+    return out
+
+def _term_matches(actual, expected):
+    if isinstance(actual, list):
+        return any(_term_matches(x, expected) for x in actual)
+    if actual is None:
+        return False
+    return str(actual) == str(expected)
+
+def _in_range(actual, bounds):
+    if actual is None:
+        return False
+    actual = _normalize(actual)
+    for op, bound in list(bounds.items()):
+        bound = _normalize(bound)
+        if op == 'gte' and not actual >= bound:
+            return False
+        if op == 'gt' and not actual > bound:
+            return False
+        if op == 'lte' and not actual <= bound:
+            return False
+        if op == 'lt' and not actual < bound:
+            return False
+    return True
+
+def _normalize(value):
+    '''timestamps compare lexically once the zone suffix is dropped'''
+    if isinstance(value, str):
+        return value.rstrip('Z')
+    return value
+
+def shapes_intersect(shape1, shape2):
+    '''bounding box intersection of two geojson geometries'''
+    bbox1 = bounding_box(shape1)
+    bbox2 = bounding_box(shape2)
+    if bbox1 is None or bbox2 is None:
+        return False
+    return not (bbox1[2] < bbox2[0] or bbox2[2] < bbox1[0] or bbox1[3] < bbox2[1] or bbox2[3] < bbox1[1])
+
+def bounding_box(shape):
+    '''returns [minlon, minlat, maxlon, maxlat] of a geojson geometry'''
+    if not isinstance(shape, dict):
+        return None
+    points = list(_iter_points(shape.get('coordinates', [])))
+    if not points:
+        return None
+    lons = [p[0] for p in points]
+    lats = [p[1] for p in points]
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+def _iter_points(coords):
+    if coords and isinstance(coords[0], (int, float)):
+        yield coords
+        return
+    for sub in coords:
+        for point in _iter_points(sub):
+            yield point
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def grq_server(monkeypatch):
+        '''pytest fixture (load with -p fake_grq) serving an empty FakeGRQ with GRQ_ES_URL pointed at it'''
+        fake = FakeGRQ().start()
+        monkeypatch.setenv('GRQ_ES_URL', fake.url)
+        yield fake
+        fake.stop()
+
+def main():
+    '''serves a recorded or synthetic corpus file until interrupted'''
+    parser = argparse.ArgumentParser(description='local stand-in for the GRQ ES proxy')
+    parser.add_argument('corpus', nargs='*', help='json files of the form {index_name: [hits]}')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds slept per request')
+    parser.add_argument('--max-page-size', type=int, default=None)
+    parser.add_argument('--max-result-window', type=int, default=None)
+    args = parser.parse_args()
+    fake = FakeGRQ(latency=args.latency, max_page_size=args.max_page_size,
+                   max_result_window=args.max_result_window, port=args.port)
+    for path in args.corpus:
+        fake.load(path)
+    fake.start()
+    print('serving {} indices on {} (export GRQ_ES_URL={})'.format(len(fake.indices), fake.url, fake.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+if __name__ == '__main__':
+    main()
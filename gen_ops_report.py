@@ -4,7 +4,6 @@
 Generates the Standard Product Ops Report
 '''
 from __future__ import print_function
-from builtins import range
 import re
 import os
 import json
@@ -12,10 +11,16 @@ import shutil
 import urllib3
 import hashlib
 import datetime
-import requests
 from openpyxl import Workbook
 import dateutil.parser
-from hysds.celery import app
+import grq
+import latency
+import metrics
+import missing
+import profiling
+import scheduler
+import spill
+import throughput
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -25,66 +30,212 @@ IDX_DCT = {'audit_trail': 'grq_*_s1-gunw-acqlist-audit_trail', 'ifg':'grq_*_s1-g
            'acq-list':'grq_*_s1-gunw-acq-list', 'ifg-cfg': 'grq_*_s1-gunw-ifg-cfg',
            'ifg-blacklist':'grq_*_blacklist', 'slc': 'grq_*_s1-iw_slc', 'acq': 'grq_*_acquisition-s1-iw_slc',
            'aoi_track': 'grq_*_s1-gunw-aoi_track'}
+# _source fields the report reads from each object type, so GRQ doesn't send the rest (footprints etc.)
+HASH_FIELDS = ['metadata.full_id_hash', 'metadata.master_scenes', 'metadata.slave_scenes',
+               'metadata.reference_scenes', 'metadata.secondary_scenes']
+TRACK_FIELDS = ['{}{}'.format(prefix, key) for prefix in ['', 'metadata.']
+                for key in ['track_number', 'track', 'trackNumber', 'track_Number']]
+SOURCE_FIELDS = {'acq': ['id', 'metadata.title', 'metadata.processing_version'], 'slc': ['id'],
+                 'acq-list': ['id', 'starttime', 'endtime', 'creation_timestamp'] + HASH_FIELDS + TRACK_FIELDS,
+                 'ifg-cfg': ['id', 'starttime', 'endtime', 'creation_timestamp'] + HASH_FIELDS,
+                 'ifg': ['id', 'starttime', 'endtime', 'creation_timestamp'] + HASH_FIELDS,
+                 'audit_trail': HASH_FIELDS, 'aoi_track': ['id', 'creation_timestamp', 'metadata.s1-gunw-ids']}
+SHEETS = ['Current Product Status', 'SLCs', 'Missing SLCs', 'Acquisitions', 'Acquisition-Lists', 'IFG-Configs', 'IFGs',
+          'Stage Latency', 'Throughput']
+# object types each sheet is built from
+SHEET_DATASETS = {'Current Product Status': ['acq', 'slc', 'acq-list', 'ifg-cfg', 'ifg', 'aoi_track'],
+                  'SLCs': ['slc'], 'Missing SLCs': ['acq', 'slc', 'acq-list'], 'Acquisitions': ['acq'],
+                  'Acquisition-Lists': ['acq-list'], 'IFG-Configs': ['ifg-cfg'], 'IFGs': ['ifg'],
+                  'Stage Latency': ['acq-list', 'ifg-cfg', 'ifg', 'aoi_track'], 'Throughput': ['acq-list', 'ifg-cfg', 'ifg']}
 
 def main():
     '''
-    Queries for relevant products & builds the report by track.
+    Queries for relevant products & builds the report by track. Products are streamed from GRQ
+    straight into the per-track index, so only the index of the current track is held in memory.
+    The object types of a track are fetched concurrently, see fetch_indices.
     '''
     ctx = load_context()
     aoi_id = ctx.get('aoi_id', False)
     aoi_index = ctx.get('aoi_index', False)
     if aoi_id is False or aoi_index is False:
         raise Exception('invalid inputs of aoi_id: {}, aoi_index: {}'.format(aoi_id, aoi_index))
-    aoi = get_aoi(aoi_id, aoi_index)
-    track_acq_lists = sort_by_track(get_objects('acq-list', aoi))
-    for track in list(track_acq_lists.keys()):
-        print('For track: {}'.format(track))
-        acqs = get_objects('acq', aoi, track)
-        slcs = get_objects('slc', aoi, track)
-        audit_trail = get_objects('audit_trail', aoi, track)
-        if len(audit_trail) < 1:
-            print('no audit trail products found for track {}'.format(track))
-            continue
-        allowed_hashes = list(set(store_by_hash(audit_trail).keys())) #allow only hashes foud in audit-trail
-        acq_lists = filter_hashes(get_objects('acq-list', aoi, track), allowed_hashes)
-        ifg_cfgs = filter_hashes(get_objects('ifg-cfg', aoi, track), allowed_hashes)
-        ifgs = filter_hashes(get_objects('ifg', aoi, track), allowed_hashes)
-        aoi_tracks = get_objects('aoi_track', aoi, track)
-        now = datetime.datetime.now().strftime('%Y%m%dT%H%M')
-        product_id = PRODUCT_NAME.format(aoi_id, track, now, VERSION)
-        generate(product_id, aoi, track, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trail, aoi_tracks)
-        print('generated {} for track: {}'.format(product_id, track))
-
-def generate(product_id, aoi, track, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trail, aoi_tracks):
-    '''generates an enumeration comparison report for the given aoi & track'''
-    # unique tracks based on acquisition list
-    if os.path.exists(product_id):
-        shutil.rmtree(product_id)
-    os.mkdir(product_id)
-    filename = '{}.xlsx'.format(product_id)
-    output_path = os.path.join(product_id, filename)
-    acq_dct = store_by_id(acqs)
-    acq_map_dct = store_by_slc_id(acqs)
-    slc_dct = store_by_id(slcs)
-    acq_list_dct = store_by_hash(acq_lists) # converts dict where key is hash of master/slave slc ids
-    ifg_cfg_dct = store_by_hash(ifg_cfgs) # converts dict where key is hash of master/slave slc ids
-    ifg_dct = store_by_hash(ifgs) # converts dict where key is hash of master/slave slc ids
-    aoi_track_dct = store_by_gunw(aoi_tracks)
-    #create workbook
-    wb = Workbook()
-    write_current_status(wb, acq_list_dct, ifg_cfg_dct, ifg_dct, slc_dct, acq_map_dct, aoi_track_dct)
-    write_slcs(wb, slc_dct)
-    write_missing_slcs(wb, slc_dct, acq_lists)
-    write_acqs(wb, acq_dct)
-    write_acq_lists(wb, acq_list_dct)
-    write_ifg_cfgs(wb, ifg_cfg_dct)
-    write_ifgs(wb, ifg_dct)
-    #save output 
-    wb.save(output_path)
-    gen_product_met(aoi, product_id, track)
-
-def write_current_status(wb, acq_list_dict, ifg_cfg_dct, ifg_dct, slc_dct, acq_map_dct, aoi_track_dct):
-    '''generate the sheet for enumerated products'''
+    grq.configure(ctx)
+    spill.configure(ctx)
+    scheduler.configure(ctx)
+    throughput.configure(ctx)
+    sheets = get_sheets(ctx)
+    with profiling.profiled(ctx) as product_dirs:
+        aoi = get_aoi(aoi_id, aoi_index)
+        metrics.start_track(aoi_id)
+        with metrics.phase('query'):
+            tracks = get_tracks(get_objects('acq-list', aoi))
+        for track in tracks:
+            print('For track: {}'.format(track))
+            metrics.start_track(aoi_id, track)
+            audit_trail = get_objects('audit_trail', aoi, track)
+            acqs = get_objects('acq', aoi, track)
+            slcs = get_objects('slc', aoi, track)
+            acq_lists = get_objects('acq-list', aoi, track)
+            ifg_cfgs = get_objects('ifg-cfg', aoi, track)
+            ifgs = get_objects('ifg', aoi, track)
+            aoi_tracks = get_objects('aoi_track', aoi, track)
+            now = datetime.datetime.now().strftime('%Y%m%dT%H%M')
+            product_id = PRODUCT_NAME.format(aoi_id, track, now, VERSION)
+            #allow only hashes found in audit-trail
+            if not generate(product_id, aoi, track, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trail, aoi_tracks, sheets):
+                print('no audit trail products found for track {}'.format(track))
+                continue
+            product_dirs.append(product_id)
+            print('generated {} for track: {}'.format(product_id, track))
+    metrics.export_prometheus(ctx, 'ops_report')
+
+def generate(product_id, aoi, track, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trail, aoi_tracks, sheets=None):
+    '''generates an ops report with the given sheets (default all) for the aoi & track. The product inputs
+    may be any iterables & are only consumed, once, into the track index if a selected sheet needs them, so
+    get_objects generators of unused object types never query GRQ. Only the hashes held by the audit trail
+    (unless it is None) are reported, & no product is written if it is empty. Returns whether a product was written'''
+    sheets = sheets or SHEETS
+    needed = set(object_type for sheet in sheets for object_type in get_datasets(sheet))
+    with spill.track_index(): # indices past the memory budget are spilled to disk
+        with metrics.phase('fetch_index'):
+            indices = fetch_indices(needed, acqs, slcs, acq_lists, ifg_cfgs, ifgs, aoi_tracks, audit_trail,
+                                    audit_counter(audit_trail, aoi, track))
+        if indices is None:
+            return False
+        acq_dct = indices.get('acq', {})
+        acq_map_dct = indices.get('acq_map', {})
+        slc_dct = indices.get('slc', {})
+        acq_list_dct = indices.get('acq-list', {}) # converts dict where key is hash of master/slave slc ids
+        ifg_cfg_dct = indices.get('ifg-cfg', {}) # converts dict where key is hash of master/slave slc ids
+        ifg_dct = indices.get('ifg', {}) # converts dict where key is hash of master/slave slc ids
+        aoi_track_dct = indices.get('aoi_track_map', {}) # converts dict where key is GUNW id & value is aoi_track id
+        if os.path.exists(product_id):
+            shutil.rmtree(product_id)
+        os.mkdir(product_id)
+        filename = '{}.xlsx'.format(product_id)
+        output_path = os.path.join(product_id, filename)
+        with metrics.phase('missing_slcs'):
+            missing_by_hash, missing_slcs = missing.find_missing(acq_list_dct.items(), slc_dct.keys(), acq_map_dct)
+        #create workbook
+        wb = Workbook()
+        if 'Current Product Status' in sheets:
+            with metrics.phase('write_current_status'):
+                write_current_status(wb, acq_list_dct, ifg_cfg_dct, ifg_dct, missing_by_hash, aoi_track_dct)
+        else:
+            wb.remove(wb.active)
+        if 'SLCs' in sheets:
+            with metrics.phase('write_slcs'):
+                write_slcs(wb, slc_dct)
+        if 'Missing SLCs' in sheets:
+            with metrics.phase('write_missing_slcs'):
+                ranking = missing.rank_missing(missing_by_hash, acq_map_dct)
+                write_missing_slcs(wb, ranking)
+                write_missing_slc_feed(product_id, aoi, track, ranking)
+        if 'Acquisitions' in sheets:
+            with metrics.phase('write_acqs'):
+                write_acqs(wb, acq_dct)
+        if 'Acquisition-Lists' in sheets:
+            with metrics.phase('write_acq_lists'):
+                write_acq_lists(wb, acq_list_dct)
+        if 'IFG-Configs' in sheets:
+            with metrics.phase('write_ifg_cfgs'):
+                write_ifg_cfgs(wb, ifg_cfg_dct)
+        if 'IFGs' in sheets:
+            with metrics.phase('write_ifgs'):
+                write_ifgs(wb, ifg_dct)
+        stage_latency = None
+        if 'Stage Latency' in sheets:
+            with metrics.phase('write_stage_latency'):
+                stage_latency = latency.analyze(acq_list_dct, ifg_cfg_dct, ifg_dct, aoi_track_dct, indices.get('aoi_track', {}))
+                write_stage_latency(wb, stage_latency)
+        if 'Throughput' in sheets:
+            with metrics.phase('write_throughput'):
+                rows = write_throughput(wb, aoi, track, acq_list_dct, ifg_cfg_dct, ifg_dct)
+                throughput.write_chart(os.path.join(product_id, '{}.throughput.png'.format(product_id)), rows,
+                                       'Products created on track {}'.format(track))
+        metrics.record_rows(wb)
+        #save output
+        with metrics.phase('save'):
+            wb.save(output_path)
+    gen_product_met(aoi, product_id, track, stage_latency)
+    return True
+
+def fetch_indices(needed, acqs, slcs, acq_lists, ifg_cfgs, ifgs, aoi_tracks, audit_trail=None, audit_count=None):
+    '''
+    builds the track indices of the needed object types concurrently & returns them by object type. Given
+    an audit trail, the hashed types wait for it & keep only its hashes, while acqs, slcs & aoi_tracks start
+    at once. audit_count, a function returning the number of audit trail products (a _count query), runs
+    alongside them & an empty audit trail cancels every fetch at its next item. Returns None if the audit
+    trail is empty.
+    '''
+    schedule = scheduler.Scheduler()
+    audit_depends = []
+    if audit_trail is not None:
+        if audit_count is not None:
+            schedule.add('audit_count', audit_count, cancel_if=lambda count: not count)
+        schedule.add('audit_trail', lambda: set(get_hash(obj) for obj in schedule.cancellable(audit_trail)),
+                     cancel_if=lambda allowed_hashes: not allowed_hashes)
+        audit_depends = ['audit_trail']
+    def by_id(obj_list):
+        def build(allowed_hashes=None):
+            return store_by_id(schedule.cancellable(obj_list))
+        return build
+    def by_hash(obj_list):
+        def build(allowed_hashes=None):
+            objs = schedule.cancellable(obj_list)
+            if allowed_hashes is not None:
+                objs = filter_hashes(objs, allowed_hashes)
+            return store_by_hash(objs)
+        return build
+    tasks = [('acq', by_id(acqs), []),
+             ('slc', by_id(slcs), []),
+             ('aoi_track', by_id(aoi_tracks), []),
+             ('acq-list', by_hash(acq_lists), audit_depends),
+             ('ifg-cfg', by_hash(ifg_cfgs), audit_depends),
+             ('ifg', by_hash(ifgs), audit_depends)]
+    for object_type, build, depends in tasks:
+        if object_type in needed:
+            schedule.add(object_type, build, depends)
+    if 'acq' in needed:
+        schedule.add('acq_map', lambda acq_dct: store_by_slc_id(acq_dct.values()), ['acq'])
+    if 'aoi_track' in needed:
+        schedule.add('aoi_track_map', lambda aoi_track_dct: store_by_gunw(aoi_track_dct.values()), ['aoi_track'])
+    indices = schedule.run()
+    metrics.record_schedule(schedule.summary())
+    if schedule.cancelled.is_set():
+        return None
+    return indices
+
+def audit_counter(audit_trail, aoi, track):
+    '''returns a function counting the audit trail: its length if it is a list, else a _count query'''
+    if audit_trail is None:
+        return None
+    if isinstance(audit_trail, (list, tuple)):
+        return lambda: len(audit_trail)
+    return lambda: count_objects('audit_trail', aoi, track)
+
+def get_datasets(sheet):
+    '''object types the sheet is built from. The Throughput sheet needs none in aggregation mode'''
+    if sheet == 'Throughput' and throughput.SETTINGS['mode'] == 'aggregation':
+        return []
+    return SHEET_DATASETS.get(sheet)
+
+def get_sheets(ctx):
+    '''returns the sheets selected by the `sheets` field of the context, a list or comma separated
+    string of sheet titles (case insensitive). Defaults to all sheets'''
+    selected = ctx.get('sheets', False)
+    if not selected:
+        return list(SHEETS)
+    if not isinstance(selected, list):
+        selected = selected.split(',')
+    selected = [sheet.strip().lower() for sheet in selected if sheet.strip()]
+    unknown = [sheet for sheet in selected if sheet not in [x.lower() for x in SHEETS]]
+    if unknown:
+        raise Exception('unknown sheets: {}. Valid sheets are: {}'.format(', '.join(unknown), ', '.join(SHEETS)))
+    return [sheet for sheet in SHEETS if sheet.lower() in selected]
+
+def write_current_status(wb, acq_list_dict, ifg_cfg_dct, ifg_dct, missing_by_hash, aoi_track_dct):
+    '''generate the sheet for enumerated products. missing_by_hash is from missing.find_missing'''
     ws = wb.active
     ws.title = 'Current Product Status'
     title = ['date pair', 'acquisition-list', 'ifg-cfg', 'ifg', 'hash', 'missing_slc_ids', 'missing_acq_ids', 'aoi_track_id']
@@ -98,19 +249,12 @@ def write_current_status(wb, acq_list_dict, ifg_cfg_dct, ifg_dct, slc_dct, acq_m
         acq_list_id = acq_list.get('_id', 'MISSING')
         ifg_id = ifg.get('_id', 'MISSING')
         aoi_track_id = aoi_track_dct.get(ifg_id, 'MISSING')
-        missing_slcs = []
-        missing_acqs = []
-        acq_list_slcs = acq_list.get('_source').get('metadata').get('master_scenes') + acq_list.get('_source').get('metadata').get('slave_scenes')
-        for slc_id in acq_list_slcs:
-            if not slc_dct.get(slc_id, False):
-                missing_slcs.append(slc_id)
-                missing_acq = acq_map_dct.get(slc_id, False)
-                if missing_acq:
-                    missing_acq_id = missing_acq.get('_id')
-                    missing_acqs.append(missing_acq_id)
+        missing_slcs, missing_acqs = missing_by_hash.get(id_hash, ([], []))
         missing_slc_str = ', '.join(missing_slcs)
         missing_acq_str = ', '.join(missing_acqs) 
         ws.append([date_pair, acq_list_id, ifg_cfg_id, ifg_id, id_hash, missing_slc_str, missing_acq_str, aoi_track_id])
+    metrics.record_missing('ifg-cfg', len([x for x in acq_list_dict if x not in ifg_cfg_dct]))
+    metrics.record_missing('gunw', len([x for x in acq_list_dict if x not in ifg_dct]))
 
 def write_slcs(wb, slc_dct):
     '''generates the sheet for slcs'''
@@ -119,21 +263,22 @@ def write_slcs(wb, slc_dct):
     for slc_id in list(slc_dct.keys()):
         ws.append([slc_id])
 
-def write_missing_slcs(wb, slc_dct, acq_lists):
-    '''generates the sheet for missing slcs'''
+def write_missing_slcs(wb, ranking):
+    '''generates the sheet for missing slcs, in localization priority order (see missing.rank_missing)'''
     ws = wb.create_sheet('Missing SLCs')
-    ws.append(['slc_id'])
-    missing = []
-    for acq_list in acq_lists:
-        master_scenes = acq_list.get('_source', {}).get('metadata', {}).get('master_scenes', [])
-        slave_scenes = acq_list.get('_source', {}).get('metadata', {}).get('slave_scenes', [])
-        all_scenes = master_scenes + slave_scenes
-        for slc_id in all_scenes:
-            if slc_dct.get(slc_id, False) is False:
-                missing.append(slc_id)
-    missing = list(set(missing))
-    for slc_id in missing:
-        ws.append([slc_id])
+    ws.append(['slc_id', 'priority', 'unlocks', 'sole_blocker_of', 'blocks', 'acq_id'])
+    metrics.record_missing('slc', len(ranking))
+    for slc in ranking:
+        ws.append([slc['slc_id'], slc['priority'], slc['unlocks'], slc['sole_blocker_of'], slc['blocks'],
+                   slc['acq_id'] or 'MISSING'])
+
+def write_missing_slc_feed(product_id, aoi, track, ranking):
+    '''writes the missing slcs in priority order as json next to the report, for the localization jobs'''
+    feed = {'aoi': aoi.get('_source', {}).get('id', aoi.get('_id')), 'track_number': track,
+            'generated': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'missing_slcs': ranking}
+    outpath = os.path.join(product_id, '{}.missing_slcs.json'.format(product_id))
+    with open(outpath, 'w') as outf:
+        json.dump(feed, outf)
 
 def write_acqs(wb, acq_dct):
     '''generates the sheet for acquisitions'''
@@ -180,7 +325,41 @@ def write_hysds_enumerated_date_pairs(wb, acq_list_dct):
         date_pair = gen_date_pair(acq_list_dct.get(id_hash))
         ws.append([date_pair])
 
-def gen_product_met(aoi, product_id, track):
+def write_stage_latency(wb, stage_latency):
+    '''generates the sheet of stage latency percentiles & the slowest hashes, in hours'''
+    ws = wb.create_sheet('Stage Latency')
+    ws.append(['stage', 'count'] + ['p{}_hours'.format(pct) for pct in latency.PERCENTILES] + ['max_hours'])
+    stage_names = [latency.stage_name(start, end) for start, end in latency.STAGES]
+    for name in stage_names + [latency.stage_name(*latency.TOTAL)]:
+        stats = stage_latency['stages'][name]
+        ws.append([name, stats['count']] + [hours(stats['p{}'.format(pct)]) for pct in latency.PERCENTILES] + [hours(stats['max'])])
+    ws.append([])
+    ws.append(['slowest hashes', 'acquisition-list'] + ['{} hours'.format(name) for name in stage_names] + ['total_hours', 'bottleneck'])
+    for slow in stage_latency['slowest']:
+        ws.append([slow['hash'], slow['acq_list_id']] + [hours(slow['latency_s'][name]) for name in stage_names] +
+                  [hours(slow['total_s']), slow['bottleneck']])
+
+def write_throughput(wb, aoi, track, acq_list_dct, ifg_cfg_dct, ifg_dct):
+    '''generates the sheet of daily created products & returns its rows'''
+    ws = wb.create_sheet('Throughput')
+    ws.append(['date'] + [label for _, label in throughput.OBJECT_TYPES] + ['backlog'])
+    if throughput.SETTINGS['mode'] == 'aggregation':
+        counts = dict((object_type, get_daily_counts(object_type, aoi, track)) for object_type, _ in throughput.OBJECT_TYPES)
+    else:
+        dcts = {'acq-list': acq_list_dct, 'ifg-cfg': ifg_cfg_dct, 'ifg': ifg_dct}
+        counts = dict((object_type, throughput.daily_counts(dcts[object_type].values())) for object_type, _ in throughput.OBJECT_TYPES)
+    rows = throughput.series(counts)
+    for row in rows:
+        ws.append(row)
+    return rows
+
+def hours(seconds):
+    '''seconds to hours for the latency sheet, blank if unknown'''
+    if seconds is None:
+        return ''
+    return round(seconds / 3600.0, 2)
+
+def gen_product_met(aoi, product_id, track, stage_latency=None):
     '''generates the appropriate product json files in the product directory'''
     location = aoi.get('_source', {}).get('location', False)
     starttime = aoi.get('_source', {}).get('starttime', False)
@@ -189,7 +368,9 @@ def gen_product_met(aoi, product_id, track):
     outpath = os.path.join(product_id, '{}.dataset.json'.format(product_id))
     with open(outpath, 'w') as outf:
         json.dump(ds_json, outf)
-    met_json = {'track_number': track}
+    met_json = {'track_number': track, 'report_metrics': metrics.track_metrics().summary()}
+    if stage_latency is not None:
+        met_json['stage_latency'] = stage_latency
     outpath = os.path.join(product_id, '{}.met.json'.format(product_id))
     with open(outpath, 'w') as outf:
         json.dump(met_json, outf)
@@ -226,23 +407,22 @@ def sort_date_pair_list(date_pair_list):
     return output_list
 
 def filter_hashes(obj_list, allowed_hashes):
-    '''filters out all objects in the object list that aren't storing any of the allowed hashes.'''
-    filtered_objs = []
+    '''yields the objects in the object list that store one of the allowed hashes.'''
+    allowed_hashes = set(allowed_hashes)
     for obj in obj_list:
-        full_id_hash = get_hash(obj)
-        if full_id_hash in allowed_hashes:
-            filtered_objs.append(obj)
-    return filtered_objs
+        if get_hash(obj) in allowed_hashes:
+            yield obj
 
 def store_by_hash(obj_list):
     '''returns a dict where the objects are stored by their full_id_hash. drops duplicates.'''
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         full_id_hash = get_hash(obj)
-        if full_id_hash in list(result_dict.keys()):
+        if full_id_hash in result_dict:
             result_dict[full_id_hash] = get_most_recent(obj, result_dict.get(full_id_hash))
         else:
             result_dict[full_id_hash] = obj
+    spill.check()
     return result_dict
 
 def get_most_recent(obj1, obj2):
@@ -255,43 +435,46 @@ def get_most_recent(obj1, obj2):
 
 def store_by_id(obj_list):
     '''returns a dict where the objects are stored by their object id'''
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         obj_id = obj.get('_source', {}).get('id', False)
         if obj_id:
             result_dict[obj_id] = obj
+    spill.check()
     return result_dict
 
-def sort_by_track(es_result_list):
+def get_tracks(es_result_list):
     '''
-    Goes through the objects in the result list, and places them in an dict where key is track
+    Goes through the objects in the result list, and returns their distinct tracks in order of appearance
     '''
-    sorted_dict = {}
+    tracks = []
+    seen = set()
     for result in es_result_list:
         track = get_track(result)
-        if track in list(sorted_dict.keys()):
-            sorted_dict.get(track, []).append(result)
-        else:
-            sorted_dict[track] = [result]
-    return sorted_dict
+        if track not in seen:
+            seen.add(track)
+            tracks.append(track)
+    return tracks
 
 def store_by_slc_id(obj_list):
     '''returns a dict where acquisitions are stored by their slc id'''
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         slc_id = obj.get('_source', {}).get('metadata', {}).get('title', False)
         if slc_id:
             result_dict[slc_id] = obj
+    spill.check()
     return result_dict
 
 def store_by_gunw(obj_list):
     '''returns a dict where the key is GUNW id and the value is the AOI_TRACK id'''
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         aoi_track_id = obj.get('_source', {}).get('id', False)
         gunw_ids = obj.get('_source', {}).get('metadata', {}).get('s1-gunw-ids', [])
         for gunw_id in gunw_ids:
             result_dict[gunw_id] = aoi_track_id
+    spill.check()
     return result_dict
 
 def get_track(es_obj):
@@ -367,75 +550,69 @@ def gen_hash(es_obj):
     return id_hash
 
 def get_objects(object_type, aoi, track_number=False):
-    '''returns all objects of the object type ['ifg, acq-list, 'ifg-blacklist'] that intersect both
-    temporally and spatially with the aoi'''
+    '''yields all objects of the object type ['ifg, acq-list, 'ifg-blacklist'] that intersect both
+    temporally and spatially with the aoi, a page at a time & projected to their SOURCE_FIELDS'''
+    grq_url, grq_queries = get_queries(object_type, aoi, track_number, grq.time_windows)
+    if object_type in SOURCE_FIELDS:
+        grq_queries = [dict(grq_query, _source=SOURCE_FIELDS.get(object_type)) for grq_query in grq_queries]
+    count = 0
+    try:
+        for result in grq.iter_windows(grq_url, grq_queries, object_type):
+            count += 1
+            yield result
+    finally:
+        metrics.record_documents(object_type, count)
+
+def get_queries(object_type, aoi, track_number=False, windows=None):
+    '''returns the search url & the queries for the object type over the aoi, one per time window
+    returned by windows(starttime, endtime), or a single one for the aoi's span'''
     #determine index
     idx = IDX_DCT.get(object_type)
     starttime = aoi.get('_source', {}).get('starttime')
     endtime = aoi.get('_source', {}).get('endtime')
-    location = aoi.get('_source', {}).get('location')
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, idx)
+    location = grq.geo_shape(aoi)
+    grq_ip = grq.get_grq_ip()
+    grq_url = '{0}/es/{1}/_search'.format(grq_ip, grq.resolve_index(grq_ip, idx))
     track_field = 'track_number'
     if object_type == 'slc' and track_number:
         track_field = 'trackNumber'
-    if track_number:
-        grq_query = {"query":{"filtered":{"query":{"geo_shape":{"location": {"shape":location}}},
-                     "filter":{"bool":{"must":[{"term":{"metadata.{}".format(track_field):track_number}},
-                     {"range":{"endtime":{"gte":starttime}}}, {"range":{"starttime":{"lte":endtime}}}]}}}},
-                     "from":0,"size":1000}
-    else:
-        grq_query = {"query":{"filtered":{"query":{"geo_shape":{"location": {"shape":location}}},
-                     "filter":{"bool":{"must":[{"range":{"endtime":{"gte":starttime}}},
-                     {"range":{"starttime":{"lte":endtime}}}]}}}},
-                     "from":0,"size":1000}
+    grq_queries = []
+    for window_start, window_end in (windows or (lambda start, end: [(start, end)]))(starttime, endtime):
+        if track_number:
+            grq_query = {"query":{"filtered":{"query":{"geo_shape":{"location": location}},
+                         "filter":{"bool":{"must":[{"term":{"metadata.{}".format(track_field):track_number}},
+                         {"range":{"endtime":{"gte":window_start}}}, {"range":{"starttime":{"lte":window_end}}}]}}}},
+                         "from":0,"size":1000}
+        else:
+            grq_query = {"query":{"filtered":{"query":{"geo_shape":{"location": location}},
+                         "filter":{"bool":{"must":[{"range":{"endtime":{"gte":window_start}}},
+                         {"range":{"starttime":{"lte":window_end}}}]}}}},
+                         "from":0,"size":1000}
+        grq_queries.append(grq_query)
     if object_type == 'audit_trail' or object_type == 'aoi_track':
-        grq_query = {"query":{"bool":{"must":[{"term":{"metadata.aoi.raw": aoi.get('_source').get('id')}},{"term":{"metadata.track_number": track_number}}]}},"from":0,"size":1000}
-    results = query_es(grq_url, grq_query)
-    return results
+        grq_queries = [{"query":{"bool":{"must":[{"term":{"metadata.aoi.raw": aoi.get('_source').get('id')}},{"term":{"metadata.track_number": track_number}}]}},"from":0,"size":1000}]
+    return grq_url, grq_queries
 
-def query_es(grq_url, es_query):
-    '''
-    Runs the query through Elasticsearch, iterates until
-    all results are generated, & returns the compiled result
-    '''
-    # make sure the fields from & size are in the es_query
-    if 'size' in list(es_query.keys()):
-        iterator_size = es_query['size']
-    else:
-        iterator_size = 10
-        es_query['size'] = iterator_size
-    if 'from' in list(es_query.keys()):
-        from_position = es_query['from']
-    else:
-        from_position = 0
-        es_query['from'] = from_position
-    #run the query and iterate until all the results have been returned
-    #print('querying: {}\n{}'.format(grq_url, json.dumps(es_query)))
-    response = requests.post(grq_url, data=json.dumps(es_query), verify=False)
-    #print('status code: {}'.format(response.status_code))
-    #print('response text: {}'.format(response.text))
-    response.raise_for_status()
-    results = json.loads(response.text, encoding='ascii')
-    results_list = results.get('hits', {}).get('hits', [])
-    total_count = results.get('hits', {}).get('total', 0)
-    for i in range(iterator_size, total_count, iterator_size):
-        es_query['from'] = i
-        #print('querying: {}\n{}'.format(grq_url, json.dumps(es_query)))
-        response = requests.post(grq_url, data=json.dumps(es_query), timeout=60, verify=False)
-        response.raise_for_status()
-        results = json.loads(response.text, encoding='ascii')
-        results_list.extend(results.get('hits', {}).get('hits', []))
-    return results_list
+def count_objects(object_type, aoi, track_number=False):
+    '''returns the number of objects of the object type get_objects would yield, from a _count query.
+    Duplicates are counted'''
+    grq_url, grq_queries = get_queries(object_type, aoi, track_number)
+    return grq.count_es(grq_url, grq_queries[0])
+
+def get_daily_counts(object_type, aoi, track_number):
+    '''returns {YYYY-MM-DD: count} of the object type's creation_timestamps from an ES date_histogram.
+    Counts every matching document, including the duplicates & hashes the report leaves out'''
+    grq_url, grq_queries = get_queries(object_type, aoi, track_number)
+    return throughput.histogram_counts(grq.post(grq_url, throughput.date_histogram(grq_queries[0])))
 
 def get_aoi(aoi_id, aoi_index):
     '''
     retrieves the AOI from ES
     '''
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+    grq_ip = grq.get_grq_ip()
     grq_url = '{0}/es/{1}/_search'.format(grq_ip, aoi_index)
     es_query = {"query":{"bool":{"must":[{"term":{"id.raw":aoi_id}}]}}}
-    result = query_es(grq_url, es_query)
+    result = grq.query_es(grq_url, es_query)
     if len(result) < 1:
         raise Exception('Found no results for AOI: {}'.format(aoi_id))
     return result[0]
@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 from __future__ import print_function
 from builtins import str
-from builtins import range
 import json
 import urllib3
 import hashlib
 import datetime
-import requests
 import argparse
 import dateutil.parser
-from hysds.celery import app
+import grq
+import metrics
+import missing
+import profiling
+import spill
 from hysds_commons.net_utils import get_container_host_ip
 
 import smtplib
@@ -46,25 +48,29 @@ def generate_aoi_track_report(aoi_idx, aoi_id):
         raise Exception('invalid inputs of aoi_id: {}, aoi_index: {}'.format(aoi_id, aoi_idx))
 
     aoi = get_aoi(aoi_id, aoi_idx)
-    track_acq_lists = sort_by_track(get_objects('acq-list', aoi))
+    metrics.start_track(aoi_id)
+    with metrics.phase('query'):
+        track_acq_lists = sort_by_track(get_objects('acq-list', aoi))
 
     html_email_template = ''
     for track in list(track_acq_lists.keys()):
-        acqs = get_objects('acq', aoi, track)
-        slcs = get_objects('slc', aoi, track)
-
-        audit_trail = get_objects('audit_trail', aoi, track)
+        metrics.start_track(aoi_id, track)
+        with metrics.phase('query'):
+            acqs = get_objects('acq', aoi, track)
+            slcs = get_objects('slc', aoi, track)
+            audit_trail = get_objects('audit_trail', aoi, track)
         if len(audit_trail) < 1:
             print('no audit trail products found for track {}'.format(track))
             continue
         else:
             print('Generating report for track: {}'.format(track))
 
-        allowed_hashes = list(set(store_by_hash(audit_trail).keys()))  # allow only hashes foud in audit-trail
-        acq_lists = filter_hashes(get_objects('acq-list', aoi, track), allowed_hashes)
-        ifg_cfgs = filter_hashes(get_objects('ifg-cfg', aoi, track), allowed_hashes)
-        ifgs = filter_hashes(get_objects('ifg', aoi, track), allowed_hashes)
-        aoi_tracks = get_objects('aoi_track', aoi, track)
+        with metrics.phase('query'):
+            allowed_hashes = list(set(store_by_hash(audit_trail).keys()))  # allow only hashes foud in audit-trail
+            acq_lists = filter_hashes(get_objects('acq-list', aoi, track), allowed_hashes)
+            ifg_cfgs = filter_hashes(get_objects('ifg-cfg', aoi, track), allowed_hashes)
+            ifgs = filter_hashes(get_objects('ifg', aoi, track), allowed_hashes)
+            aoi_tracks = get_objects('aoi_track', aoi, track)
 
         now = datetime.datetime.now().strftime('%Y%m%dT%H%M')
         product_id = PRODUCT_NAME.format(aoi_id, track, now, VERSION)
@@ -77,22 +83,38 @@ def generate_aoi_track_report(aoi_idx, aoi_id):
 
 def generate(product_id, aoi, track, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audit_trail, aoi_tracks):
     """generates an enumeration comparison report for the given aoi & track"""
-    acq_dct = store_by_id(acqs)
-    acq_map_dct = store_by_slc_id(acqs)
-    slc_dct = store_by_id(slcs)
-    acq_list_dct = store_by_hash(acq_lists)  # converts dict where key is hash of master/slave slc ids
-    ifg_cfg_dct = store_by_hash(ifg_cfgs)  # converts dict where key is hash of master/slave slc ids
-    ifg_dct = store_by_hash(ifgs)  # converts dict where key is hash of master/slave slc ids
-    aoi_track_dct = store_by_gunw(aoi_tracks)
-
-    missing_slcs_data = generate_missing_slcs_data(slc_dct, acq_lists)  # get missing SLCs data
-    # generate data for the product status report
-    product_status_data, product_status_summary = generate_product_status_data(acq_list_dct, ifg_cfg_dct, ifg_dct,
-                                                                               slc_dct, acq_map_dct, aoi_track_dct)
-
-    if len(product_status_data) == 0 and len(missing_slcs_data) == 0:
-        return ''  # returning nothing because there is nothing to report on
-
+    with spill.track_index():  # indices past the memory budget are spilled to disk
+        with metrics.phase('index'):
+            acq_dct = store_by_id(acqs)
+            acq_map_dct = store_by_slc_id(acqs)
+            slc_dct = store_by_id(slcs)
+            acq_list_dct = store_by_hash(acq_lists)  # converts dict where key is hash of master/slave slc ids
+            ifg_cfg_dct = store_by_hash(ifg_cfgs)  # converts dict where key is hash of master/slave slc ids
+            ifg_dct = store_by_hash(ifgs)  # converts dict where key is hash of master/slave slc ids
+            aoi_track_dct = store_by_gunw(aoi_tracks)
+
+        with metrics.phase('missing_slcs'):
+            missing_by_hash, missing_slcs_data = missing.find_missing(acq_list_dct.items(), slc_dct.keys(), acq_map_dct)
+            missing_slcs_data = [slc['slc_id'] for slc in missing.rank_missing(missing_by_hash)]  # localization priority order
+        # generate data for the product status report
+        with metrics.phase('product_status'):
+            product_status_data, product_status_summary = generate_product_status_data(acq_list_dct, ifg_cfg_dct, ifg_dct,
+                                                                                       missing_by_hash, aoi_track_dct)
+        metrics.record_row_count('Missing SLCs', len(missing_slcs_data))
+        metrics.record_row_count('Product Status', len(product_status_data))
+        metrics.record_missing('slc', len(missing_slcs_data))
+        metrics.record_missing('ifg-cfg', product_status_summary[4])
+        metrics.record_missing('gunw', product_status_summary[5])
+
+        if len(product_status_data) == 0 and len(missing_slcs_data) == 0:
+            return ''  # returning nothing because there is nothing to report on
+
+        with metrics.phase('html'):
+            return build_track_html(product_id, missing_slcs_data, product_status_data, product_status_summary)
+
+
+def build_track_html(product_id, missing_slcs_data, product_status_data, product_status_summary):
+    """builds the html tables for a single aoi & track"""
     aoi_html_report = '<h3 style="font-family:Arial, Helvetica, sans-serif;">{track}</h3>'.format(track=product_id)
 
     if missing_slcs_data:
@@ -107,14 +129,13 @@ def generate(product_id, aoi, track, acqs, slcs, acq_lists, ifg_cfgs, ifgs, audi
     return aoi_html_report
 
 
-def generate_product_status_data(acq_list_dict, ifg_cfg_dct, ifg_dct, slc_dct, acq_map_dct, aoi_track_dct):
+def generate_product_status_data(acq_list_dict, ifg_cfg_dct, ifg_dct, missing_by_hash, aoi_track_dct):
     """
     generate the sheet for enumerated products
     :param acq_list_dict: dict type,
     :param ifg_cfg_dct: dict type,
     :param ifg_dct: dict type,
-    :param slc_dct: dict type,
-    :param acq_map_dct: dict type,
+    :param missing_by_hash: dict type, missing slc & acq ids by hash from missing.find_missing
     :param aoi_track_dct: dict type,
     :return: list[list[]], list[]  # main report data and summary row
     """
@@ -131,19 +152,7 @@ def generate_product_status_data(acq_list_dict, ifg_cfg_dct, ifg_dct, slc_dct, a
         ifg_id = ifg.get('_id', 'MISSING')
         aoi_track_id = aoi_track_dct.get(ifg_id, 'MISSING')
 
-        missing_slcs = []
-        missing_acqs = []
-
-        acq_list_slcs = acq_list.get('_source', {}).get('metadata', {}).get('master_scenes', {}) + \
-                        acq_list.get('_source', {}).get('metadata', {}).get('slave_scenes', {})
-
-        for slc_id in acq_list_slcs:
-            if not slc_dct.get(slc_id, False):
-                missing_slcs.append(slc_id)
-                missing_acq = acq_map_dct.get(slc_id, False)
-                if missing_acq:
-                    missing_acq_id = missing_acq.get('_id')
-                    missing_acqs.append(missing_acq_id)
+        missing_slcs, missing_acqs = missing_by_hash.get(id_hash, ([], []))
 
         missing_slc_str = ', '.join(missing_slcs)
         missing_acq_str = ', '.join(missing_acqs)
@@ -186,12 +195,12 @@ def pull_black_and_grey_list():
       }
     }
 
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+    grq_ip = grq.get_grq_ip()
 
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, greylist_index)
-    grey_list = query_es(grq_url, es_query)
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, blacklist_index)
-    black_list = query_es(grq_url, es_query)
+    grq_url = '{0}/es/{1}/_search'.format(grq_ip, grq.resolve_index(grq_ip, greylist_index))
+    grey_list = grq.query_es(grq_url, es_query)
+    grq_url = '{0}/es/{1}/_search'.format(grq_ip, grq.resolve_index(grq_ip, blacklist_index))
+    black_list = grq.query_es(grq_url, es_query)
 
     black_list = {row['fields']['metadata.full_id_hash'][0] for row in black_list}
     grey_list = {row['fields']['metadata.full_id_hash'][0] for row in grey_list}
@@ -199,29 +208,9 @@ def pull_black_and_grey_list():
     return grey_list, black_list
 
 
-def generate_missing_slcs_data(slc_dct, acq_lists):
-    """
-    generates the sheet for missing slcs
-    :param slc_dct:
-    :param acq_lists:
-    :return: str, html string for the missing SLCs table
-    """
-    missing = []
-    for acq_list in acq_lists:
-        master_scenes = acq_list.get('_source', {}).get('metadata', {}).get('master_scenes', [])
-        slave_scenes = acq_list.get('_source', {}).get('metadata', {}).get('slave_scenes', [])
-        all_scenes = master_scenes + slave_scenes
-
-        for slc_id in all_scenes:
-            if slc_dct.get(slc_id, False) is False:
-                missing.append(slc_id)
-
-    missing = list(set(missing))
-    return missing
-
-
 def filter_hashes(obj_list, allowed_hashes):
     """filters out all objects in the object list that aren't storing any of the allowed hashes."""
+    allowed_hashes = set(allowed_hashes)
     filtered_objs = []
     for obj in obj_list:
         full_id_hash = get_hash(obj)
@@ -232,13 +221,14 @@ def filter_hashes(obj_list, allowed_hashes):
 
 def store_by_hash(obj_list):
     """returns a dict where the objects are stored by their full_id_hash. drops duplicates."""
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         full_id_hash = get_hash(obj)
-        if full_id_hash in list(result_dict.keys()):
+        if full_id_hash in result_dict:
             result_dict[full_id_hash] = get_most_recent(obj, result_dict.get(full_id_hash))
         else:
             result_dict[full_id_hash] = obj
+    spill.check()
     return result_dict
 
 
@@ -253,11 +243,12 @@ def get_most_recent(obj1, obj2):
 
 def store_by_id(obj_list):
     """returns a dict where the objects are stored by their object id"""
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         obj_id = obj.get('_source', {}).get('id', False)
         if obj_id:
             result_dict[obj_id] = obj
+    spill.check()
     return result_dict
 
 
@@ -268,7 +259,7 @@ def sort_by_track(es_result_list):
     sorted_dict = {}
     for result in es_result_list:
         track = get_track(result)
-        if track in list(sorted_dict.keys()):
+        if track in sorted_dict:
             sorted_dict.get(track, []).append(result)
         else:
             sorted_dict[track] = [result]
@@ -277,22 +268,24 @@ def sort_by_track(es_result_list):
 
 def store_by_slc_id(obj_list):
     """returns a dict where acquisitions are stored by their slc id"""
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         slc_id = obj.get('_source', {}).get('metadata', {}).get('title', False)
         if slc_id:
             result_dict[slc_id] = obj
+    spill.check()
     return result_dict
 
 
 def store_by_gunw(obj_list):
     """returns a dict where the key is GUNW id and the value is the AOI_TRACK id"""
-    result_dict = {}
+    result_dict = spill.index()
     for obj in obj_list:
         aoi_track_id = obj.get('_source', {}).get('id', False)
         gunw_ids = obj.get('_source', {}).get('metadata', {}).get('s1-gunw-ids', [])
         for gunw_id in gunw_ids:
             result_dict[gunw_id] = aoi_track_id
+    spill.check()
     return result_dict
 
 
@@ -374,46 +367,47 @@ def get_objects(object_type, aoi, track_number=False):
     idx = IDX_DCT.get(object_type)  # determine index
     starttime = aoi.get('_source', {}).get('starttime')
     endtime = aoi.get('_source', {}).get('endtime')
-    location = aoi.get('_source', {}).get('location')
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
-    grq_url = '{0}/es/{1}/_search'.format(grq_ip, idx)
+    location = grq.geo_shape(aoi)
+    grq_ip = grq.get_grq_ip()
+    grq_url = '{0}/es/{1}/_search'.format(grq_ip, grq.resolve_index(grq_ip, idx))
     track_field = 'track_number'
     if object_type == 'slc' and track_number:
         track_field = 'trackNumber'
 
-    grq_query = {
-        "query": {
-            "filtered": {
-                "query": {
-                    "geo_shape": {
-                        "location": {
-                            "shape": location
+    grq_queries = []
+    for window_start, window_end in grq.time_windows(starttime, endtime):
+        grq_query = {
+            "query": {
+                "filtered": {
+                    "query": {
+                        "geo_shape": {
+                            "location": location
+                        }
+                    },
+                    "filter": {
+                        "bool": {
+                            "must": [
+                                # {"term": {"metadata.{}".format(track_field): track_number}},
+                                {"range": {"endtime": {"gte": window_start}}},
+                                {"range": {"starttime": {"lte": window_end}}}
+                            ]
                         }
-                    }
-                },
-                "filter": {
-                    "bool": {
-                        "must": [
-                            # {"term": {"metadata.{}".format(track_field): track_number}},
-                            {"range": {"endtime": {"gte": starttime}}},
-                            {"range": {"starttime": {"lte": endtime}}}
-                        ]
                     }
                 }
-            }
-        },
-        "from": 0,
-        "size": 1000
-    }
-    if track_number:
-        grq_query['query']['filtered']['filter']['bool']['must'].append({
-            "term": {
-                "metadata.{}".format(track_field): track_number
-            }
-        })
+            },
+            "from": 0,
+            "size": 1000
+        }
+        if track_number:
+            grq_query['query']['filtered']['filter']['bool']['must'].append({
+                "term": {
+                    "metadata.{}".format(track_field): track_number
+                }
+            })
+        grq_queries.append(grq_query)
 
     if object_type == 'audit_trail' or object_type == 'aoi_track':
-        grq_query = {
+        grq_queries = [{
             "query": {
                 "bool": {
                     "must": [
@@ -424,49 +418,16 @@ def get_objects(object_type, aoi, track_number=False):
             },
             "from": 0,
             "size": 1000
-        }
+        }]
 
-    results = query_es(grq_url, grq_query)
+    results = grq.query_windows(grq_url, grq_queries, object_type)
+    metrics.record_documents(object_type, len(results))
     return results
 
 
-def query_es(grq_url, es_query):
-    """
-    Runs the query through Elasticsearch, iterates until
-    all results are generated, & returns the compiled result
-    """
-    # make sure the fields from & size are in the es_query
-    if 'size' in list(es_query.keys()):
-        iterator_size = es_query['size']
-    else:
-        iterator_size = 10
-        es_query['size'] = iterator_size
-    if 'from' in list(es_query.keys()):
-        from_position = es_query['from']
-    else:
-        from_position = 0
-        es_query['from'] = from_position
-
-    response = requests.post(grq_url, data=json.dumps(es_query), verify=False)
-    response.raise_for_status()
-    results = json.loads(response.text, encoding='ascii')
-
-    results_list = results.get('hits', {}).get('hits', [])
-    total_count = results.get('hits', {}).get('total', 0)
-
-    for i in range(iterator_size, total_count, iterator_size):
-        es_query['from'] = i
-        response = requests.post(grq_url, data=json.dumps(es_query), timeout=60, verify=False)
-        response.raise_for_status()
-        results = json.loads(response.text, encoding='ascii')
-        results_list.extend(results.get('hits', {}).get('hits', []))
-
-    return results_list
-
-
 def get_aoi(aoi_id, index):
     'retrieves the AOI from ES'
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+    grq_ip = grq.get_grq_ip()
     grq_url = '{0}/es/{1}/_search'.format(grq_ip, index)
     es_query = {
         "query": {
@@ -478,7 +439,7 @@ def get_aoi(aoi_id, index):
         }
     }
 
-    result = query_es(grq_url, es_query)
+    result = grq.query_es(grq_url, es_query)
     if len(result) < 1:
         raise Exception('Found no results for AOI: {}'.format(aoi_id))
     return result[0]
@@ -497,7 +458,7 @@ def load_context():
 
 
 def get_all_aois(es_index):
-    grq_ip = app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+    grq_ip = grq.get_grq_ip()
     grq_url = '{0}/es/{1}/_search'.format(grq_ip, es_index)
 
     es_query = {
@@ -512,11 +473,30 @@ def get_all_aois(es_index):
         }
     }
 
-    res = query_es(grq_url, es_query)
+    res = grq.query_es(grq_url, es_query)
     list_aoi = [row['fields']['_id'] for row in res]
     return list_aoi
 
 
+def create_metrics_html(summary):
+    """
+    builds the run-level instrumentation summary table
+    :param summary: dict, output of metrics.ReportMetrics.summary()
+    :return: str, html heading & table
+    """
+    print('run metrics: {}'.format(json.dumps(summary, sort_keys=True)))
+    rows = []
+    for name in sorted(summary['phases'], key=lambda x: -summary['phases'][x]['wall_s']):
+        phase = summary['phases'][name]
+        rows.append([name, phase['wall_s'], phase['cpu_s'], phase['calls']])
+    es = summary['es']
+    es_row = [es['requests'], es['bytes_received'], es['latency_s']['p50'], es['latency_s']['p90'], es['latency_s']['p99']]
+    html = '<h3 style="font-family:Arial, Helvetica, sans-serif;">Report Metrics ({}s)</h3>'.format(summary['wall_s'])
+    html += create_html_table(['Phase', 'Wall (s)', 'CPU (s)', 'Calls'], rows)
+    html += create_html_table(['ES Requests', 'Bytes Received', 'p50 (s)', 'p90 (s)', 'p99 (s)'], [es_row])
+    return html
+
+
 def dict_to_inline_style(css_styles):
     """
     flattens dictionary to inline style
@@ -601,6 +581,7 @@ if __name__ == '__main__':
     parser.add_argument('--aoi_index')
     args = parser.parse_args()
 
+    ctx = {}
     if args.aoi_index:  # aoi index as python argument
         aoi_index = args.aoi_index
     else:  # handles on demand job submission
@@ -608,13 +589,18 @@ if __name__ == '__main__':
         aoi_index = ctx.get('aoi_index', False)
         aoi_index = ','.join(list(set(aoi_index)))
 
-    aoi_list = get_all_aois(aoi_index)
-    print(json.dumps(sorted(aoi_list), indent=2))
-
-    complete_aoi_reports = '<html> <div style="padding:10px;">'
-    for _id in sorted(aoi_list):
-        aoi_report_html = generate_aoi_track_report(aoi_index, _id)
-        complete_aoi_reports += aoi_report_html
+    grq.configure(ctx)
+    spill.configure(ctx)
+    with profiling.profiled(ctx):  # no product directory, profiles are written to the work dir
+        aoi_list = get_all_aois(aoi_index)
+        print(json.dumps(sorted(aoi_list), indent=2))
+
+        complete_aoi_reports = '<html> <div style="padding:10px;">'
+        for _id in sorted(aoi_list):
+            aoi_report_html = generate_aoi_track_report(aoi_index, _id)
+            complete_aoi_reports += aoi_report_html
+    complete_aoi_reports += create_metrics_html(metrics.run_metrics().summary())
+    metrics.export_prometheus(ctx, 'ops_report_email')
     complete_aoi_reports += '</html>'
 
     current_timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
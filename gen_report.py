@@ -28,6 +28,7 @@ def main():
     aoi_index = ctx.get('aoi_index', False)
     if aoi_id is False or aoi_index is False:
         raise Exception('invalid inputs of aoi_id: {}, aoi_index: {}'.format(aoi_id, aoi_index))
+    excel.configure(ctx)
     aoi = get_aoi(aoi_id, aoi_index)
     enumeration = ctx.get('date_pairs', False) #list of date pairs
     if enumeration:
@@ -144,7 +145,7 @@ def sort_by_frame(obj_list):
     sorted_dict = {}
     for result in obj_list:
         frame = result.get('_source', {}).get('metadata', {}).get('frame_id')
-        if frame in list(sorted_dict.keys()):
+        if frame in sorted_dict:
             sorted_dict.get(frame, []).append(result)
         else:
             sorted_dict[frame] = [result]
@@ -233,7 +234,7 @@ def sort_by_track(es_result_list):
     sorted_dict = {}
     for result in es_result_list:
         track = get_track(result)
-        if track in list(sorted_dict.keys()):
+        if track in sorted_dict:
             sorted_dict.get(track, []).append(result)
         else:
             sorted_dict[track] = [result]
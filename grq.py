@@ -0,0 +1,753 @@
+#!/usr/bin/env python
+
+'''
+Shared helpers for talking to the GRQ Elasticsearch proxy
+'''
+from __future__ import print_function
+import os
+import json
+import re
+import math
+import time
+import hashlib
+import datetime
+import threading
+import requests
+import dateutil.parser
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import profiling
+from hysds.celery import app
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from shapely.geometry import shape, mapping
+except ImportError:
+    shape = mapping = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# query layer settings. Overridden by GRQ_<KEY> environment variables & then by the same keys in _context.json
+SETTINGS = {
+    'page_min_size': 100, # bounds for the adaptive page size
+    'page_max_size': 10000,
+    'page_target_bytes': 8 * 1024 * 1024, # aim for pages of about this many response bytes
+    'page_target_latency': 10.0, # & of about this many seconds
+    'stream_decode': 'auto', # parse search responses incrementally with ijson: auto, always or never
+    'stream_decode_bytes': 32 * 1024 * 1024, # in auto mode, responses decoding to more than this are parsed incrementally
+    'page_size_cache': os.path.join(os.path.expanduser('~'), '.cache', 'standard_product_report', 'page_sizes.json'),
+    'plan_queries': True, # run a _count preflight & pick a fetch strategy for typed queries
+    'plan_parallel_max': 10000, # counts up to this are fetched as parallel from/size pages, larger ones are scrolled
+    'max_result_window': 10000, # the cluster's index.max_result_window, from + size of a page may not pass it
+    'plan_warn_count': 250000, # warn when a single query matches more than this
+    'plan_abort_count': 0, # refuse to fetch queries matching more than this (0 disables)
+    'parallel_workers': 4,
+    'scroll_keepalive': '5m',
+    'scroll_slices': 0, # max parallel slices for scrolled queries of slice_types (0 disables, needs ES 5+ & bool queries)
+    'scroll_slice_size': 100000, # aim for about this many documents per slice
+    'slice_types': 'slc,acq',
+    'resolve_indices': True, # expand wildcard index patterns to concrete indices once per run
+    'index_versions': 0, # only query the newest N versions of each pattern (0 keeps all versions)
+    'time_windows': '', # split AOI time spans into windows fetched concurrently: year, month or a number of equal windows
+    'window_workers': 4,
+    'window_queue_batches': 4, # batches of WINDOW_BATCH hits a window's worker may fetch ahead of the consumer
+    'aoi_shape_mode': 'simplify', # AOI shape sent in geo_shape queries: simplify, indexed (reference the AOI doc) or raw
+    'aoi_simplify_tolerance': 0.005, # degrees the simplified outline may deviate from the AOI's
+    'aoi_simplify_min_points': 200, # AOIs with fewer vertices are sent as is
+    'aoi_buffer': 0.001, # extra degrees added around the simplified AOI on top of the tolerance
+    'aoi_shape_cache': os.path.join(os.path.expanduser('~'), '.cache', 'standard_product_report', 'aoi_shapes'),
+}
+REQUEST_HEADERS = {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'}
+WINDOW_BATCH = 500 # hits handed from a time window's worker to the consumer at a time
+GZIP_RATIO = 8 # estimated decoded bytes per gzipped byte of a search response
+_learned_sizes = None # object type -> page size, loaded from the page size cache
+_resolved = {} # (grq ip, index pattern) -> concrete index expression
+_shapes = {} # aoi id & location checksum -> simplified location
+_lock = threading.Lock()
+_shape_lock = threading.Lock() # the concurrent fetches of a track simplify the AOI once
+
+def configure(ctx=None):
+    '''applies environment & context overrides to SETTINGS'''
+    ctx = ctx or {}
+    for key, default in list(SETTINGS.items()):
+        value = ctx.get(key, os.environ.get('GRQ_{}'.format(key.upper()), None))
+        if value is None or value == '':
+            continue
+        SETTINGS[key] = cast(value, default)
+    return SETTINGS
+
+def cast(value, default):
+    '''casts a context/environment value to the type of the default setting'''
+    if isinstance(default, bool):
+        return str(value).lower() in ['true', '1', 'yes']
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+def get_grq_ip():
+    '''returns the base url of the GRQ ES proxy. A GRQ_ES_URL environment variable overrides the
+    celery config & is used verbatim, so the reports can be pointed at a local stand-in'''
+    env_url = os.environ.get('GRQ_ES_URL', False)
+    if env_url:
+        return env_url.rstrip('/')
+    return app.conf['GRQ_ES_URL'].replace(':9200', '').replace('http://', 'https://')
+
+def resolve_index(grq_ip, pattern):
+    '''
+    expands a wildcard index pattern such as grq_*_s1-gunw into a comma separated list of the concrete
+    indices it matches, optionally only the newest index_versions of them. Resolved once per run; if
+    the pattern can't be resolved it is returned as is.
+    '''
+    if not SETTINGS['resolve_indices'] or '*' not in pattern:
+        return pattern
+    key = (grq_ip, pattern)
+    with _lock:
+        if key in _resolved:
+            return _resolved[key]
+    indices = list_indices(grq_ip, pattern)
+    if SETTINGS['index_versions'] and indices:
+        versions = sorted(set(index_version(pattern, idx) for idx in indices), key=version_key, reverse=True)
+        newest = versions[:SETTINGS['index_versions']]
+        indices = [idx for idx in indices if index_version(pattern, idx) in newest]
+    resolved = ','.join(sorted(indices)) if indices else pattern
+    print('resolved index {} to {}'.format(pattern, resolved))
+    with _lock:
+        _resolved[key] = resolved
+    return resolved
+
+def list_indices(grq_ip, pattern):
+    '''
+    returns the open index names matching the pattern from _cat/indices, falling back to _alias. Closed
+    indices are left out: wildcard searches skip them, but naming one fails the query
+    '''
+    try:
+        response = requests.get('{}/es/_cat/indices/{}'.format(grq_ip, pattern), params={'h': 'index,status'},
+                                timeout=30, verify=False)
+        response.raise_for_status()
+        rows = [line.split() for line in response.text.splitlines() if line.strip()]
+        return sorted(set(row[0] for row in rows if len(row) < 2 or row[1] == 'open'))
+    except requests.exceptions.RequestException as err:
+        print('unable to list indices for {} through _cat/indices: {}'.format(pattern, err))
+    try:
+        response = requests.get('{}/es/{}/_alias'.format(grq_ip, pattern), params={'expand_wildcards': 'open'},
+                                timeout=30, verify=False)
+        response.raise_for_status()
+        return sorted(json.loads(response.text).keys())
+    except (requests.exceptions.RequestException, ValueError) as err:
+        print('unable to list indices for {} through _alias: {}'.format(pattern, err))
+    return []
+
+def index_version(pattern, index):
+    '''returns the part of the index name matched by the pattern's wildcard, eg. v2.0 for grq_v2.0_s1-gunw'''
+    regex = '^{}$'.format('(.*?)'.join(re.escape(part) for part in pattern.split('*')))
+    match = re.match(regex, index)
+    if not match:
+        return ''
+    return '_'.join(match.groups())
+
+def version_key(version):
+    '''sort key ordering version strings numerically, so v10.0 is newer than v9.1'''
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', version)]
+
+def geo_shape(aoi):
+    '''
+    returns the geo_shape clause params for the AOI: its location simplified to aoi_simplify_tolerance &
+    buffered so it still covers the whole AOI, a reference to the indexed AOI document, or the raw location
+    '''
+    source = aoi.get('_source', {})
+    location = source.get('location')
+    mode = SETTINGS['aoi_shape_mode']
+    if mode == 'indexed' and aoi.get('_id') and aoi.get('_index'):
+        return {'indexed_shape': {'id': aoi['_id'], 'type': aoi.get('_type', 'area_of_interest'),
+                                  'index': aoi['_index'], 'path': 'location'}}
+    if mode == 'simplify' and location:
+        with _shape_lock:
+            return {'shape': simplify_location(source.get('id', aoi.get('_id', '')), location)}
+    return {'shape': location}
+
+def simplify_location(aoi_id, location):
+    '''returns the simplified location, cached in memory & on disk by AOI id & location checksum'''
+    checksum = hashlib.sha1(json.dumps(location, sort_keys=True).encode('utf8')).hexdigest()
+    key = '{}-{}'.format(aoi_id, checksum)
+    if key in _shapes:
+        return _shapes[key]
+    path = os.path.join(SETTINGS['aoi_shape_cache'], '{}.json'.format(key))
+    try:
+        with open(path, 'r') as fin:
+            _shapes[key] = json.load(fin)
+            return _shapes[key]
+    except (IOError, OSError, ValueError):
+        pass
+    simplified = build_simplified(location)
+    _shapes[key] = simplified
+    if simplified is not location:
+        try:
+            if not os.path.exists(SETTINGS['aoi_shape_cache']):
+                os.makedirs(SETTINGS['aoi_shape_cache'])
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'w') as outf:
+                json.dump(simplified, outf)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as err:
+            print('unable to cache simplified AOI shape to {}: {}'.format(path, err))
+    return simplified
+
+def build_simplified(location):
+    '''
+    simplifies the location to within aoi_simplify_tolerance & buffers it by the tolerance plus aoi_buffer,
+    so every point of the original lies inside the result. Returns the location unchanged if shapely is
+    unavailable, the AOI is already small or the result would not cover it.
+    '''
+    if shape is None:
+        print('shapely is not installed, querying with the raw AOI shape')
+        return location
+    try:
+        geom = shape(location)
+    except (ValueError, TypeError, AttributeError) as err:
+        print('unable to parse AOI shape, querying with the raw AOI shape: {}'.format(err))
+        return location
+    points = count_points(location.get('coordinates', []))
+    if points < SETTINGS['aoi_simplify_min_points']:
+        return location
+    tolerance = SETTINGS['aoi_simplify_tolerance']
+    simplified = geom.simplify(tolerance, preserve_topology=True).buffer(tolerance + SETTINGS['aoi_buffer'], join_style=2)
+    if simplified.is_empty or not simplified.is_valid or not simplified.covers(geom):
+        print('simplified AOI shape does not cover the AOI, querying with the raw AOI shape')
+        return location
+    result = json.loads(json.dumps(mapping(simplified))) # tuples to lists
+    if count_points(result['coordinates']) >= points:
+        return location
+    print('simplified AOI shape from {} to {} points'.format(points, count_points(result['coordinates'])))
+    return result
+
+def count_points(coordinates):
+    '''number of positions in a geojson coordinates array'''
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return 1
+    return sum(count_points(x) for x in coordinates)
+
+def post(grq_url, es_query, timeout=None):
+    '''posts the query to GRQ & returns the whole decoded response (counts, aggregations...), recording the
+    request in the report metrics'''
+    return post_page(grq_url, es_query, timeout, incremental=False)[0]
+
+def post_page(grq_url, es_query, timeout=None, params=None, incremental=True):
+    '''
+    posts the query to GRQ. Returns the decoded response, the response size in bytes & the latency.
+    The hits of paged fetches are better read through stream_page, which doesn't hold them all.
+    '''
+    page = {}
+    hits = list(stream_page(grq_url, es_query, page, timeout, params, incremental))
+    results = page['results']
+    if hits or 'hits' in results:
+        results.setdefault('hits', {})['hits'] = hits
+    return results, page['nbytes'], page['latency']
+
+def stream_page(grq_url, es_query, page, timeout=None, params=None, incremental=True):
+    '''
+    posts the query to GRQ & yields the hits of the response as they are decoded. page is filled with the
+    response's other fields under results (as they are read), & once the hits are exhausted with the
+    response size in bytes & the latency, not counting the time the caller spent between hits. Search
+    responses are parsed incrementally with ijson when should_stream says so, else decoded whole with
+    orjson/json. Only scalars are kept outside the hits when parsing incrementally, so responses with
+    other arrays (aggregations) need incremental=False.
+    '''
+    start = time.time()
+    paused = 0.0
+    page['results'] = results = {}
+    page['nbytes'] = 0
+    response = requests.post(grq_url, data=json.dumps(es_query), params=params, timeout=timeout, verify=False,
+                             headers=REQUEST_HEADERS, stream=True)
+    try:
+        response.raise_for_status()
+        if incremental and should_stream(response):
+            reader = CountingReader(response.raw)
+            for hit in stream_hits(reader, results):
+                page['nbytes'] = reader.nbytes
+                before = time.time()
+                yield hit
+                paused += time.time() - before
+            page['nbytes'] = reader.nbytes
+        else:
+            content = response.content
+            page['nbytes'] = len(content)
+            results.update(decode(content))
+            hits = results.get('hits', {}).pop('hits', [])
+            hits.reverse()
+            while hits: # hand the hits over one at a time, releasing each from the decoded page
+                before = time.time()
+                yield hits.pop()
+                paused += time.time() - before
+    finally:
+        response.close()
+        page['latency'] = time.time() - start - paused
+        metrics.record_request(page['nbytes'], page['latency'])
+
+def should_stream(response):
+    '''
+    whether to parse the response incrementally: never without ijson, else per the stream_decode setting.
+    In auto mode, bodies of unknown length (chunked) & bodies whose length, scaled by GZIP_RATIO when
+    they are gzipped, passes stream_decode_bytes are streamed
+    '''
+    mode = str(SETTINGS['stream_decode']).lower()
+    if ijson is None or mode == 'never':
+        return False
+    if mode == 'always':
+        return True
+    length = response.headers.get('Content-Length', None)
+    if not length:
+        return True
+    ratio = GZIP_RATIO if 'gzip' in response.headers.get('Content-Encoding', '') else 1
+    return int(length) * ratio > SETTINGS['stream_decode_bytes']
+
+def decode(content):
+    '''decodes a response body with orjson when available'''
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content.decode('utf8'))
+
+class CountingReader(object):
+    '''file-like wrapper over the raw response that decompresses & counts the bytes read'''
+    def __init__(self, raw):
+        self.raw = raw
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        if size == 0:
+            return b''
+        data = self.raw.read(size if size > 0 else None, decode_content=True)
+        self.nbytes += len(data)
+        return data
+
+def stream_hits(reader, results):
+    '''
+    incrementally parses a search response, yielding its hits one at a time. The response's other
+    scalars (_scroll_id, took, hits.total, count...) are stored into results as they are read.
+    '''
+    builder = None
+    for prefix, event, value in ijson.parse(reader, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == 'hits.hits.item' and event == 'end_map':
+                yield builder.value
+                builder = None
+        elif prefix == 'hits.hits.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+        elif event in ['string', 'number', 'boolean', 'null'] and not prefix.startswith('hits.hits'):
+            target = results
+            keys = prefix.split('.')
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = value
+
+def query_es(grq_url, es_query, object_type=None):
+    '''
+    Runs the query through Elasticsearch, iterates until
+    all results are generated, & returns the compiled result.
+    Typed queries (object_type set) are planned from a _count preflight.
+    '''
+    return list(iter_es(grq_url, es_query, object_type))
+
+def iter_es(grq_url, es_query, object_type=None):
+    '''generator over the query's hits, fetched a page at a time as they are consumed'''
+    if object_type and SETTINGS['plan_queries']:
+        plan = plan_query(grq_url, es_query, object_type)
+        hits = execute_plan(grq_url, es_query, plan)
+    else:
+        hits = page_es(grq_url, es_query, object_type)
+    for hit in hits:
+        yield hit
+
+def query_windows(grq_url, es_queries, object_type=None):
+    '''returns the merged hits of the time window queries'''
+    return list(iter_windows(grq_url, es_queries, object_type))
+
+def iter_windows(grq_url, es_queries, object_type=None):
+    '''
+    runs the queries of each time window concurrently & yields their hits in window order. Products
+    spanning a window boundary match both windows, so only the first hit per index & _id is kept.
+    Each window is iterated a page at a time on a worker, which hands its hits over in batches through a
+    bounded queue, so a window runs at most window_queue_batches batches ahead of the consumer. Closing
+    the generator stops the workers at their next batch instead of waiting for every window.
+    '''
+    if len(es_queries) == 1:
+        for hit in iter_es(grq_url, es_queries[0], object_type):
+            yield hit
+        return
+    workers = max(1, min(SETTINGS['window_workers'], len(es_queries)))
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=max(1, SETTINGS['window_queue_batches'])) for _ in es_queries]
+    executor = ThreadPoolExecutor(max_workers=workers)
+    for es_query, batches in zip(es_queries, queues):
+        executor.submit(profiling.threaded(fetch_window), grq_url, es_query, object_type, batches, stop)
+    seen = set()
+    try:
+        for hit in drain_batches(queues):
+            key = (hit.get('_index'), hit.get('_id'))
+            if key in seen:
+                continue
+            seen.add(key)
+            yield hit
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+def fetch_window(grq_url, es_query, object_type, batches, stop):
+    '''iterates the hits of a window on a worker thread onto the batches queue (see fetch_batches)'''
+    fetch_batches(lambda: iter_es(grq_url, es_query, object_type), batches, stop)
+
+def fetch_batches(iterate, batches, stop):
+    '''iterates the hits of iterate() on a worker thread, putting them on the batches queue in batches of
+    WINDOW_BATCH, then None, or the error that stopped it. Returns early once stop is set'''
+    if stop.is_set():
+        return
+    hits = None
+    batch = []
+    try:
+        hits = iterate()
+        for hit in hits:
+            batch.append(hit)
+            if len(batch) >= WINDOW_BATCH:
+                if not put_batch(batches, batch, stop):
+                    return
+                batch = []
+        if batch and not put_batch(batches, batch, stop):
+            return
+        put_batch(batches, None, stop)
+    except Exception as err:
+        put_batch(batches, err, stop)
+    finally:
+        if hits is not None:
+            hits.close()
+
+def drain_batches(queues):
+    '''yields the hits of each queue filled by fetch_batches in turn, raising the error a worker put on it'''
+    for batches in queues:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            for hit in batch:
+                yield hit
+
+def put_batch(batches, item, stop):
+    '''puts the item on the bounded queue, waiting for room until stop is set. Returns whether it was put'''
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def time_windows(starttime, endtime):
+    '''
+    splits the starttime/endtime span into windows per the time_windows setting & returns them as a
+    list of (start, end) strings. Returns the span as a single window if windowing is off or the times
+    can't be parsed.
+    '''
+    setting = str(SETTINGS['time_windows']).strip().lower()
+    if setting in ['', '0', '1', 'false', 'none'] or not starttime or not endtime:
+        return [(starttime, endtime)]
+    try:
+        start = dateutil.parser.parse(starttime)
+        end = dateutil.parser.parse(endtime)
+        if end <= start:
+            return [(starttime, endtime)]
+        bounds = [start]
+        if setting in ['year', 'month']:
+            current = start
+            while True:
+                if setting == 'year':
+                    current = datetime.datetime(current.year + 1, 1, 1, tzinfo=start.tzinfo)
+                else:
+                    current = datetime.datetime(current.year + current.month // 12, current.month % 12 + 1, 1, tzinfo=start.tzinfo)
+                if current >= end:
+                    break
+                bounds.append(current)
+        else:
+            step = (end - start) / int(setting)
+            bounds.extend(start + step * i for i in range(1, int(setting)))
+    except (ValueError, TypeError, OverflowError) as err:
+        print('unable to split {} to {} into time windows: {}'.format(starttime, endtime, err))
+        return [(starttime, endtime)]
+    bounds = [x.strftime('%Y-%m-%dT%H:%M:%S') for x in bounds[1:]]
+    return list(zip([starttime] + bounds, bounds + [endtime]))
+
+def plan_query(grq_url, es_query, object_type):
+    '''
+    counts the query's matches & picks a fetch strategy: a single page for small results, parallel
+    from/size pages for medium ones & a scroll for large ones. Warns on, or refuses, huge results.
+    '''
+    count = count_es(grq_url, es_query)
+    page_size = initial_page_size(object_type, es_query.get('size', 10))
+    if count <= page_size:
+        strategy = 'single'
+    elif count <= min(SETTINGS['plan_parallel_max'], SETTINGS['max_result_window']):
+        strategy = 'parallel'
+    else:
+        strategy = 'scroll'
+    plan = {'object_type': object_type, 'count': count, 'strategy': strategy, 'page_size': page_size,
+            'pages': int(math.ceil(count / float(page_size)))}
+    slice_types = [x.strip() for x in str(SETTINGS['slice_types']).split(',')]
+    if strategy == 'scroll' and SETTINGS['scroll_slices'] and object_type in slice_types:
+        slices = min(SETTINGS['scroll_slices'], int(math.ceil(count / float(max(SETTINGS['scroll_slice_size'], 1)))))
+        if slices > 1 and uses_filtered(es_query):
+            print('not slicing the {} scroll: its filtered query needs ES before 5.0, which has no sliced scroll'.format(object_type))
+        elif slices > 1:
+            plan['strategy'] = 'sliced_scroll'
+            plan['slices'] = slices
+    print('query plan: {}'.format(json.dumps(plan, sort_keys=True)))
+    metrics.record_plan(plan)
+    if SETTINGS['plan_abort_count'] and count > SETTINGS['plan_abort_count']:
+        raise Exception('{} query matched {} documents, more than plan_abort_count {}. Refusing to fetch: {}'.format(
+            object_type, count, SETTINGS['plan_abort_count'], grq_url))
+    if count > SETTINGS['plan_warn_count']:
+        print('WARNING: {} query matched {} documents (plan_warn_count {})'.format(object_type, count, SETTINGS['plan_warn_count']))
+    return plan
+
+def uses_filtered(es_query):
+    '''returns whether the query uses the filtered query, which ES 5.0 removed'''
+    if isinstance(es_query, dict):
+        return 'filtered' in es_query or any(uses_filtered(value) for value in es_query.values())
+    if isinstance(es_query, list):
+        return any(uses_filtered(value) for value in es_query)
+    return False
+
+def execute_plan(grq_url, es_query, plan):
+    '''returns an iterator over the query's hits, fetched with the planned strategy'''
+    if plan['count'] == 0:
+        return iter([])
+    if plan['strategy'] == 'single':
+        return page_es(grq_url, dict(es_query, size=plan['page_size']), plan['object_type'])
+    if plan['strategy'] == 'parallel':
+        return parallel_es(grq_url, es_query, plan)
+    if plan['strategy'] == 'sliced_scroll':
+        return sliced_scroll_es(grq_url, es_query, plan)
+    return scroll_es(grq_url, es_query, plan)
+
+def count_es(grq_url, es_query):
+    '''returns the number of documents matching the query'''
+    count_query = {}
+    if 'query' in es_query:
+        count_query['query'] = es_query['query']
+    results = post(es_url(grq_url, '_count'), count_query)
+    return results.get('count', 0)
+
+def parallel_es(grq_url, es_query, plan):
+    '''
+    fetches the planned from/size pages concurrently & yields their hits in order. The last page is
+    clamped to max_result_window. A page coming back short (a cluster capping the page size) would leave
+    a gap before the next page, so the rest of the query is then paged sequentially from the end of the
+    short page, at the size the cluster returned.
+    '''
+    size = plan['page_size']
+    window = SETTINGS['max_result_window']
+    def fetch(position):
+        return post_page(grq_url, dict(es_query, size=min(size, window - position), **{'from': position}), timeout=60)
+    workers = max(1, min(SETTINGS['parallel_workers'], plan['pages']))
+    positions = range(0, min(plan['count'], window), size)
+    total_count = plan['count']
+    next_position = 0 # hits before this position have been yielded
+    short_page = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for position, (results, nbytes, latency) in zip(positions, executor.map(profiling.threaded(fetch), positions)):
+            hits = results.get('hits', {}).get('hits', [])
+            total_count = max(total_count, get_total(results))
+            if len(hits) >= size:
+                remember_page_size(plan['object_type'], next_page_size(size, len(hits), nbytes, latency))
+            for hit in hits:
+                yield hit
+            next_position = position + len(hits)
+            if next_position < min(position + size, window, total_count):
+                print('short page of {} hits at {}, paging the rest of the {} query sequentially'.format(
+                    len(hits), position, plan['object_type']))
+                short_page = len(hits) or 1
+                break
+    if total_count > next_position: # the rest after a short page, or documents that arrived after the count
+        for hit in page_es(grq_url, dict(es_query, size=short_page or size, **{'from': next_position})):
+            yield hit
+
+def sliced_scroll_es(grq_url, es_query, plan):
+    '''
+    scrolls the planned number of slices of the query concurrently & yields their hits slice by slice.
+    Like time windows, each slice is scrolled on a worker that hands its hits over through a bounded queue
+    (see fetch_batches), at most window_queue_batches batches ahead of the consumer. Falls back to a single
+    scroll if the cluster rejects the slice parameter (ES before 5.0)
+    '''
+    slices = plan['slices']
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=max(1, SETTINGS['window_queue_batches'])) for _ in range(slices)]
+    executor = ThreadPoolExecutor(max_workers=slices)
+    for slice_id, batches in enumerate(queues):
+        iterate = lambda es_slice={'id': slice_id, 'max': slices}: scroll_es(grq_url, es_query, plan, es_slice)
+        executor.submit(profiling.threaded(fetch_batches), iterate, batches, stop)
+    yielded = False
+    rejected = False
+    try:
+        for hit in drain_batches(queues):
+            yielded = True
+            yield hit
+    except requests.exceptions.HTTPError as err:
+        if yielded or err.response is None or err.response.status_code != 400:
+            raise
+        print('sliced scroll rejected, falling back to a single scroll: {}'.format(err))
+        rejected = True
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+    if rejected:
+        for hit in scroll_es(grq_url, es_query, plan):
+            yield hit
+
+def scroll_es(grq_url, es_query, plan, es_slice=None):
+    '''yields the query's hits, or those of the given slice, a page at a time through a scroll cursor'''
+    size = plan['page_size']
+    scroll_query = dict(es_query, size=size)
+    scroll_query.pop('from', None)
+    if es_slice is not None:
+        scroll_query['slice'] = es_slice
+    scroll_url = es_url(grq_url, '_search/scroll', index=False)
+    scroll_id = None
+    page = {}
+    hits = stream_page(grq_url, scroll_query, page, timeout=60, params={'scroll': SETTINGS['scroll_keepalive']})
+    try:
+        while True:
+            num_hits = 0
+            for hit in hits:
+                num_hits += 1
+                yield hit
+            scroll_id = page['results'].get('_scroll_id', scroll_id)
+            if not num_hits:
+                break
+            if num_hits >= size:
+                remember_page_size(plan['object_type'], next_page_size(size, num_hits, page['nbytes'], page['latency']))
+            page = {}
+            hits = stream_page(scroll_url, {'scroll': SETTINGS['scroll_keepalive'], 'scroll_id': scroll_id}, page, timeout=60)
+    finally:
+        hits.close()
+        clear_scroll(scroll_url, page.get('results', {}).get('_scroll_id', scroll_id))
+
+def clear_scroll(scroll_url, scroll_id):
+    '''releases the scroll context. Best effort, contexts expire on their own'''
+    if not scroll_id:
+        return
+    try:
+        requests.delete(scroll_url, data=json.dumps({'scroll_id': [scroll_id]}), timeout=10, verify=False)
+    except requests.exceptions.RequestException as err:
+        print('failed to clear scroll: {}'.format(err))
+
+def es_url(grq_url, endpoint, index=True):
+    '''swaps the _search endpoint of a GRQ search url for another ES endpoint, optionally dropping the index'''
+    base, _, rest = grq_url.partition('/es/')
+    idx = rest.split('/')[0]
+    if index:
+        return '{}/es/{}/{}'.format(base, idx, endpoint)
+    return '{}/es/{}'.format(base, endpoint)
+
+def page_es(grq_url, es_query, object_type=None):
+    '''
+    Sequentially pages through the query's results with from/size, yielding the hits of each page.
+    Page sizes adapt to the bytes per hit & latency of the previous page; the size learned
+    for an object type is persisted & used as its starting size on later runs. Pages stop at
+    max_result_window, which from/size can't page past.
+    '''
+    es_query = dict(es_query)
+    size = initial_page_size(object_type, es_query.get('size', 10))
+    position = es_query.get('from', 0)
+    window = SETTINGS['max_result_window']
+    total_count = None
+    timeout = None
+    learned = False
+    while total_count is None or position < total_count:
+        if position >= window:
+            print('WARNING: {} results past max_result_window {} were not fetched'.format(total_count - position, window))
+            break
+        es_query['from'] = position
+        es_query['size'] = min(size, window - position)
+        page = {}
+        num_hits = 0
+        for hit in stream_page(grq_url, es_query, page, timeout=timeout):
+            num_hits += 1
+            yield hit
+        total_count = get_total(page['results'])
+        if not num_hits:
+            break
+        position += num_hits
+        if num_hits >= size: # only full pages are representative
+            size = next_page_size(size, num_hits, page['nbytes'], page['latency'])
+            learned = True
+        timeout = 60
+    if object_type and learned:
+        remember_page_size(object_type, size)
+
+def get_total(results):
+    '''returns hits.total, which newer ES versions wrap in a dict'''
+    total = results.get('hits', {}).get('total', 0)
+    if isinstance(total, dict):
+        return total.get('value', 0)
+    return total
+
+def next_page_size(size, num_hits, nbytes, latency):
+    '''
+    returns the size for the next page: the smaller of the sizes that would hit the target bytes &
+    the target latency at the measured rates, growing at most 2x per page, within the min/max bounds
+    '''
+    bytes_per_hit = float(nbytes) / max(num_hits, 1)
+    by_bytes = SETTINGS['page_target_bytes'] / max(bytes_per_hit, 1.0)
+    by_latency = num_hits * SETTINGS['page_target_latency'] / max(latency, 0.001)
+    target = min(by_bytes, by_latency, size * 2)
+    return int(max(SETTINGS['page_min_size'], min(SETTINGS['page_max_size'], target)))
+
+def initial_page_size(object_type, requested_size):
+    '''returns the learned page size of the object type, or the requested size'''
+    if object_type:
+        learned = load_learned_sizes().get(object_type, False)
+        if learned:
+            return int(max(SETTINGS['page_min_size'], min(SETTINGS['page_max_size'], learned)))
+    return requested_size
+
+def load_learned_sizes():
+    '''loads the persisted page sizes once per run'''
+    global _learned_sizes
+    with _lock:
+        if _learned_sizes is None:
+            _learned_sizes = {}
+            try:
+                with open(SETTINGS['page_size_cache'], 'r') as fin:
+                    _learned_sizes = json.load(fin)
+            except (IOError, OSError, ValueError):
+                pass
+        return _learned_sizes
+
+def remember_page_size(object_type, size):
+    '''stores the page size the object type converged to & persists it. Failures to persist are not fatal'''
+    learned = load_learned_sizes()
+    with _lock:
+        if learned.get(object_type, False) == size:
+            return
+        learned[object_type] = size
+        path = SETTINGS['page_size_cache']
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'w') as outf:
+                json.dump(learned, outf, indent=2, sort_keys=True)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as err:
+            print('unable to persist page sizes to {}: {}'.format(path, err))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+'''
+Pipeline stage latencies for the ops report. The creation_timestamps of the acq-list, ifg-cfg & GUNW of
+every hash, & of the aoi_track holding its GUNW, are lined up as datetime64 arrays, so the latency of a
+stage over the whole track is one array subtraction. Summarized as percentiles per stage & the slowest hashes.
+'''
+from __future__ import print_function
+import re
+import numpy as np
+import dateutil.parser
+from dateutil.tz import tzutc
+
+STAGES = [('acq-list', 'ifg-cfg'), ('ifg-cfg', 'ifg'), ('ifg', 'aoi_track')]
+TOTAL = ('acq-list', 'aoi_track')
+PERCENTILES = [50, 90, 99]
+SLOWEST = 25 # hashes listed as the slowest of a track
+UTC_OFFSET = re.compile(r'[+-]\d{2}(:?\d{2})?$') # a zone suffix other than Z, after the date
+
+def stage_name(start, end):
+    return '{} > {}'.format(start, end)
+
+def analyze(acq_list_dct, ifg_cfg_dct, ifg_dct, aoi_track_map, aoi_track_dct):
+    '''
+    returns the latency stats in seconds of each stage (& end to end) & the slowest hashes, ranked by the
+    sum of their stage latencies, with the stage that took longest, & the number of unparseable
+    creation_timestamps per product. Stages with a missing product or timestamp are skipped.
+    aoi_track_map maps GUNW ids to aoi_track ids & aoi_track_dct holds the aoi_tracks by id.
+    '''
+    hashes = list(acq_list_dct.keys())
+    ifgs = [ifg_dct.get(id_hash, {}) for id_hash in hashes]
+    parsed = {'acq-list': parse_creation_times(acq_list_dct.get(id_hash) for id_hash in hashes),
+              'ifg-cfg': parse_creation_times(ifg_cfg_dct.get(id_hash) for id_hash in hashes),
+              'ifg': parse_creation_times(ifgs),
+              'aoi_track': parse_creation_times(aoi_track_dct.get(aoi_track_map.get(ifg.get('_id'), False), False) for ifg in ifgs)}
+    times = dict((product, times) for product, (times, _) in parsed.items())
+    unparsed = dict((product, count) for product, (_, count) in parsed.items())
+    for product, count in sorted(unparsed.items()):
+        if count:
+            print('unable to parse {} {} creation_timestamps, skipping their stages'.format(count, product))
+    names = [stage_name(start, end) for start, end in STAGES]
+    latencies = np.array([(times[end] - times[start]) / np.timedelta64(1, 's') for start, end in STAGES]).reshape(len(STAGES), len(hashes))
+    stats = dict((name, summarize(latencies[idx])) for idx, name in enumerate(names))
+    stats[stage_name(*TOTAL)] = summarize((times[TOTAL[1]] - times[TOTAL[0]]) / np.timedelta64(1, 's'))
+    slowest = []
+    reached = ~np.isnan(latencies).all(axis=0)
+    if reached.any():
+        totals = np.where(reached, np.nansum(latencies, axis=0), -np.inf)
+        bottlenecks = np.nanargmax(np.where(np.isnan(latencies), -np.inf, latencies), axis=0)
+        for idx in np.argsort(-totals, kind='mergesort')[:SLOWEST]:
+            if not reached[idx]:
+                break
+            slowest.append({'hash': hashes[idx], 'acq_list_id': acq_list_dct.get(hashes[idx]).get('_id', 'MISSING'),
+                            'latency_s': dict((name, None if np.isnan(latencies[row, idx]) else round(float(latencies[row, idx]), 1))
+                                              for row, name in enumerate(names)),
+                            'total_s': round(float(totals[idx]), 1), 'bottleneck': names[bottlenecks[idx]]})
+    return {'stages': stats, 'slowest': slowest, 'unparsed': unparsed}
+
+def summarize(values):
+    '''count, percentiles & max of the latencies that could be computed'''
+    valid = values[~np.isnan(values)]
+    stats = {'count': int(valid.size)}
+    for pct in PERCENTILES:
+        stats['p{}'.format(pct)] = round(float(np.percentile(valid, pct)), 1) if valid.size else None
+    stats['max'] = round(float(valid.max()), 1) if valid.size else None
+    return stats
+
+def creation_times(objs):
+    '''datetime64[s] array of the objects' creation_timestamps, NaT where missing or unparseable'''
+    return parse_creation_times(objs)[0]
+
+def parse_creation_times(objs):
+    '''
+    returns the datetime64[s] array of the objects' creation_timestamps, NaT where missing, & the number of
+    timestamps that are present but couldn't be parsed. Naive & Z timestamps are sliced to the second,
+    those with another utc offset are converted to utc by parse_time & non-strings are unparsed
+    '''
+    values = []
+    present = []
+    nonstrings = 0
+    for obj in objs:
+        value = (obj or {}).get('_source', {}).get('creation_timestamp') or 'NaT'
+        if not isinstance(value, str):
+            nonstrings += 1
+            value = 'NaT'
+        elif UTC_OFFSET.search(value[10:]):
+            value = parse_time(value)
+        elif value != 'NaT':
+            value = value[:19]
+        present.append(value != 'NaT')
+        values.append(value)
+    try:
+        times = np.array(values, dtype='datetime64[s]')
+    except ValueError:
+        times = np.array([parse_time(value) if isinstance(value, str) else value for value in values], dtype='datetime64[s]')
+    return times, int((np.isnat(times) & np.array(present, dtype=bool)).sum()) + nonstrings
+
+def parse_time(value):
+    '''parses a timestamp numpy can't, or one with a utc offset, as naive utc, NaT if it can't be parsed'''
+    try:
+        parsed = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        return 'NaT'
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(tzutc()).replace(tzinfo=None)
+    return parsed
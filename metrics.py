@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+'''
+Lightweight instrumentation for the report jobs: wall & cpu time per phase, ES request counts, bytes &
+latencies, document, row & missing product counts. Metrics are kept per track & for the whole run, and
+can be exported as a Prometheus text-exposition file for the node exporter textfile collector.
+'''
+from __future__ import print_function
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+PROM_PREFIX = 'standard_product_report'
+PROM_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+class ReportMetrics(object):
+    '''accumulates phase timings, ES request stats, document, row & missing product counts'''
+    def __init__(self, **labels):
+        self.labels = labels
+        self.started = time.time()
+        self.finished = None
+        self.phases = {} #phase name -> {'wall_s', 'cpu_s', 'calls'}
+        self.es_requests = 0
+        self.es_bytes = 0
+        self.es_latencies = []
+        self.rows = {} #sheet title -> row count
+        self.documents = {} #object type -> documents fetched
+        self.missing = {} #product stage -> missing count
+        self.plans = [] #query plans chosen for the track
+        self.schedule = None #fetch schedule of the track: task timings & critical path
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, wall, cpu):
+        with self._lock:
+            phase = self.phases.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'calls': 0})
+            phase['wall_s'] += wall
+            phase['cpu_s'] += cpu
+            phase['calls'] += 1
+
+    def add_request(self, nbytes, latency):
+        with self._lock:
+            self.es_requests += 1
+            self.es_bytes += nbytes
+            self.es_latencies.append(latency)
+
+    def add_rows(self, sheet, count):
+        with self._lock:
+            self.rows[sheet] = self.rows.get(sheet, 0) + count
+
+    def add_documents(self, object_type, count):
+        with self._lock:
+            self.documents[object_type] = self.documents.get(object_type, 0) + count
+
+    def add_missing(self, stage, count):
+        with self._lock:
+            self.missing[stage] = self.missing.get(stage, 0) + count
+
+    def add_plan(self, plan):
+        with self._lock:
+            self.plans.append(plan)
+
+    def set_schedule(self, schedule):
+        with self._lock:
+            self.schedule = schedule
+
+    def duration(self):
+        return (self.finished or time.time()) - self.started
+
+    def summary(self):
+        '''returns the metrics as a json serializable dict'''
+        latencies = sorted(self.es_latencies)
+        phases = dict((name, {'wall_s': round(p['wall_s'], 3), 'cpu_s': round(p['cpu_s'], 3), 'calls': p['calls']})
+                      for name, p in list(self.phases.items()))
+        es = {'requests': self.es_requests, 'bytes_received': self.es_bytes,
+              'latency_s': {'p50': percentile(latencies, 50), 'p90': percentile(latencies, 90),
+                            'p99': percentile(latencies, 99), 'max': round(latencies[-1], 3) if latencies else 0.0}}
+        return {'wall_s': round(self.duration(), 3), 'phases': phases, 'es': es, 'rows': dict(self.rows),
+                'documents': dict(self.documents), 'missing': dict(self.missing), 'plans': list(self.plans),
+                'schedule': self.schedule}
+
+_run = ReportMetrics()
+_track = ReportMetrics()
+_tracks = [] #every per-track collector of the run, in order
+
+def start_track(aoi='', track='all'):
+    '''starts a new per-track collector, closing the previous one. track 'all' covers AOI level queries'''
+    global _track
+    _track.finished = _track.finished or time.time()
+    _track = ReportMetrics(aoi=str(aoi), track=str(track))
+    _tracks.append(_track)
+    return _track
+
+def track_metrics():
+    return _track
+
+def run_metrics():
+    return _run
+
+@contextmanager
+def phase(name):
+    '''times the enclosed block into the track & run metrics'''
+    start_wall = time.time()
+    start_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.time() - start_wall
+        cpu = time.process_time() - start_cpu
+        _track.add_phase(name, wall, cpu)
+        _run.add_phase(name, wall, cpu)
+
+def record_request(nbytes, latency):
+    '''records a single ES request'''
+    _track.add_request(nbytes, latency)
+    _run.add_request(nbytes, latency)
+
+def record_rows(wb):
+    '''records the row count (less the title row) of every sheet in the workbook'''
+    for ws in wb.worksheets:
+        record_row_count(ws.title, max(ws.max_row - 1, 0))
+
+def record_row_count(sheet, count):
+    '''records the number of rows written to a sheet or table'''
+    _track.add_rows(sheet, count)
+    _run.add_rows(sheet, count)
+
+def record_documents(object_type, count):
+    '''records the number of documents of the object type fetched from GRQ'''
+    _track.add_documents(object_type, count)
+    _run.add_documents(object_type, count)
+
+def record_missing(stage, count):
+    '''records the number of missing products of a stage (slc, ifg-cfg, gunw)'''
+    _track.add_missing(stage, count)
+    _run.add_missing(stage, count)
+
+def record_plan(plan):
+    '''records a query plan against the current track'''
+    _track.add_plan(plan)
+
+def record_schedule(schedule):
+    '''records the fetch schedule summary of the current track'''
+    _track.set_schedule(schedule)
+    print('fetch schedule: critical path {critical_path_s}s ({path}), wall {wall_s}s, serial {serial_s}s'.format(
+        path=' > '.join(schedule.get('critical_path', [])), **schedule))
+
+def export_prometheus(ctx, job):
+    '''
+    writes the run's metrics as a Prometheus text-exposition file if `prometheus_textfile` is set in the
+    context or REPORT_PROM_TEXTFILE in the environment. A directory gets <job>.prom written into it.
+    '''
+    path = (ctx or {}).get('prometheus_textfile', os.environ.get('REPORT_PROM_TEXTFILE', False))
+    if not path:
+        return False
+    if os.path.isdir(path):
+        path = os.path.join(path, '{}_{}.prom'.format(PROM_PREFIX, job))
+    _track.finished = _track.finished or time.time()
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as outf:
+        outf.write(prometheus_text(job))
+    os.rename(tmp_path, path) # atomic, so the collector never reads a partial file
+    print('wrote prometheus metrics to {}'.format(path))
+    return path
+
+def prometheus_text(job):
+    '''renders the run & per-track metrics in the Prometheus text exposition format'''
+    lines = []
+    def metric(name, mtype, helptext, samples):
+        lines.append('# HELP {}_{} {}'.format(PROM_PREFIX, name, helptext))
+        lines.append('# TYPE {}_{} {}'.format(PROM_PREFIX, name, mtype))
+        for suffix, labels, value in samples:
+            lines.append('{}_{}{}{} {}'.format(PROM_PREFIX, name, suffix, format_labels(labels), value))
+    run_labels = {'report': job}
+    metric('run_duration_seconds', 'gauge', 'Wall time of the report run.',
+           [('', run_labels, round(_run.duration(), 3))])
+    metric('run_timestamp_seconds', 'gauge', 'Unix time the report run finished.', [('', run_labels, int(time.time()))])
+    metric('run_es_requests', 'gauge', 'ES requests issued by the report run.', [('', run_labels, _run.es_requests)])
+    metric('run_es_bytes', 'gauge', 'Bytes received from ES by the report run.', [('', run_labels, _run.es_bytes)])
+    tracks = [t for t in _tracks if t.es_requests or t.documents or t.phases]
+    samples = [('', track_labels(job, t), round(t.duration(), 3)) for t in tracks]
+    metric('track_duration_seconds', 'gauge', 'Wall time spent on each AOI track.', samples)
+    samples = []
+    for t in tracks:
+        labels = track_labels(job, t)
+        for bucket in PROM_BUCKETS:
+            samples.append(('_bucket', dict(labels, le=str(bucket)), len([x for x in t.es_latencies if x <= bucket])))
+        samples.append(('_bucket', dict(labels, le='+Inf'), len(t.es_latencies)))
+        samples.append(('_sum', labels, round(sum(t.es_latencies), 3)))
+        samples.append(('_count', labels, len(t.es_latencies)))
+    metric('track_fetch_latency_seconds', 'histogram', 'Latency of the ES requests made for each AOI track.', samples)
+    samples = [('', track_labels(job, t), t.schedule['critical_path_s']) for t in tracks if t.schedule]
+    metric('track_critical_path_seconds', 'gauge', 'Duration of the longest chain of dependent fetches of each AOI track.', samples)
+    samples = [('', dict(track_labels(job, t), object_type=otype), count)
+               for t in tracks for otype, count in sorted(t.documents.items())]
+    metric('documents', 'gauge', 'Documents fetched per object type for each AOI track.', samples)
+    samples = [('', dict(track_labels(job, t), stage=stage), count)
+               for t in tracks for stage, count in sorted(t.missing.items())]
+    metric('missing_products', 'gauge', 'Missing products per pipeline stage for each AOI track.', samples)
+    return '\n'.join(lines) + '\n'
+
+def track_labels(job, collector):
+    labels = dict(collector.labels)
+    labels['report'] = job
+    return labels
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+             for k, v in sorted(labels.items())]
+    return '{' + ','.join(pairs) + '}'
+
+def percentile(sorted_values, pct):
+    '''nearest-rank percentile of an already sorted list'''
+    if not sorted_values:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(sorted_values) - 1)))
+    return round(sorted_values[rank], 3)
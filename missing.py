@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+'''
+Missing SLC & acquisition engine for the ops reports. The scene references of a track's acquisition
+lists are exploded once into a (hash, slc_id) table, anti-joined against the localized SLC ids & the
+missing scenes joined to their acquisitions by title, giving the missing SLCs & acquisitions of every
+acquisition list & the track's distinct missing SLCs in one pass. The anti-join is a set probe per scene
+reference: the ids arrive as python strings, so converting them for pandas/numpy costs more than the join.
+rank_missing orders the missing SLCs by the acquisition lists their localization completes.
+'''
+from __future__ import print_function
+import heapq
+
+def find_missing(acq_lists, localized, acq_map=None):
+    '''
+    takes (hash, acq-list) pairs, the localized slc ids & optionally a dict of acquisitions by slc id
+    (title). Returns a dict of hash -> (missing slc ids, their acquisition ids), in scene order (master
+    scenes first), for the acq-lists with missing scenes, & the distinct missing slc ids in order of
+    first reference.
+    '''
+    hashes, slc_ids = scene_table(acq_lists)
+    by_hash = {}
+    missing = []
+    acq_ids = {} # missing slc id -> acquisition id, False if there's no acquisition
+    for row in missing_rows(slc_ids, localized):
+        slc_id = slc_ids[row]
+        if slc_id not in acq_ids:
+            missing.append(slc_id)
+            acq = acq_map.get(slc_id, False) if acq_map is not None else False
+            acq_ids[slc_id] = acq.get('_id', False) if acq else False
+        missing_slcs, missing_acqs = by_hash.setdefault(hashes[row], ([], []))
+        missing_slcs.append(slc_id)
+        if acq_ids[slc_id]:
+            missing_acqs.append(acq_ids[slc_id])
+    return by_hash, missing
+
+def scene_table(acq_lists):
+    '''explodes (hash, acq-list) pairs into parallel lists of hash & slc id, master scenes first'''
+    hashes = []
+    slc_ids = []
+    for id_hash, acq_list in acq_lists:
+        met = acq_list.get('_source', {}).get('metadata', {})
+        scenes = met.get('master_scenes', []) + met.get('slave_scenes', [])
+        hashes.extend([id_hash] * len(scenes))
+        slc_ids.extend(scenes)
+    return hashes, slc_ids
+
+def missing_rows(slc_ids, localized):
+    '''returns the positions of the slc ids that are not localized'''
+    localized = set(localized)
+    return [row for row, slc_id in enumerate(slc_ids) if slc_id not in localized]
+
+def blocked_by(missing_by_hash):
+    '''reverse index of the find_missing result: missing slc id -> hashes of the acq-lists it blocks'''
+    blocked = {}
+    for id_hash, (missing_slcs, _) in missing_by_hash.items():
+        for slc_id in set(missing_slcs):
+            blocked.setdefault(slc_id, []).append(id_hash)
+    return blocked
+
+def rank_missing(missing_by_hash, acq_map=None):
+    '''
+    orders the missing slcs so each localization completes the most acq-lists (GUNW pairs): repeatedly
+    picks the slc that is the last missing scene of the most acq-lists, given the slcs ranked before it,
+    breaking ties by the number of acq-lists it blocks & then by id. Returns a list of dicts per slc with
+    its priority, the acq-lists it unlocks in that order, the acq-lists it alone blocks now, the ones it
+    blocks at all & its acquisition id.
+    '''
+    blocked = blocked_by(missing_by_hash)
+    scenes = dict((id_hash, set(missing_slcs)) for id_hash, (missing_slcs, _) in missing_by_hash.items())
+    remaining = dict((id_hash, len(slc_ids)) for id_hash, slc_ids in scenes.items())
+    unlocks = dict((slc_id, len([x for x in hashes if remaining[x] == 1])) for slc_id, hashes in blocked.items())
+    sole_blocker = dict(unlocks)
+    heap = [(-unlocks[slc_id], -len(hashes), slc_id) for slc_id, hashes in blocked.items()]
+    heapq.heapify(heap)
+    ranked = set()
+    ranking = []
+    while heap:
+        neg_unlocks, _, slc_id = heapq.heappop(heap)
+        if slc_id in ranked or -neg_unlocks != unlocks[slc_id]:
+            continue # stale entry, the slc was re-queued with a higher score
+        ranked.add(slc_id)
+        acq = acq_map.get(slc_id, False) if acq_map is not None else False
+        ranking.append({'slc_id': slc_id, 'priority': len(ranking) + 1, 'unlocks': unlocks[slc_id],
+                        'sole_blocker_of': sole_blocker[slc_id], 'blocks': len(blocked[slc_id]),
+                        'acq_id': acq.get('_id', False) if acq else False, 'hashes': sorted(blocked[slc_id])})
+        for id_hash in blocked[slc_id]:
+            remaining[id_hash] -= 1
+            if remaining[id_hash] != 1:
+                continue
+            for other in scenes[id_hash]: # the last missing scene of the acq-list now completes it
+                if other not in ranked:
+                    unlocks[other] += 1
+                    heapq.heappush(heap, (-unlocks[other], -len(blocked[other]), other))
+    return ranking
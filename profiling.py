@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+'''
+Opt-in profiling of the report entry points. Enabled through the `profile` field of _context.json or
+the REPORT_PROFILE environment variable, either of which may be "cprofile", "tracemalloc", a comma
+separated combination of both, or true for both. Results are written into the product directories so
+they are published alongside the report. Work run on thread pools is profiled per thread through `threaded`
+& merged into the report's cProfile stats.
+'''
+from __future__ import print_function
+import os
+import io
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+PROFILERS = ['cprofile', 'tracemalloc']
+DEFAULT_TOP_N = 50
+_thread_profiles = None # profiles of the work run through threaded, while cProfile is enabled
+_lock = threading.Lock()
+_local = threading.local() # marks the threads already profiled by threaded
+
+def get_settings(ctx=None):
+    '''returns (list of enabled profilers, top n) from the context, falling back to the environment'''
+    ctx = ctx or {}
+    value = ctx.get('profile', os.environ.get('REPORT_PROFILE', False))
+    top_n = int(ctx.get('profile_top_n', os.environ.get('REPORT_PROFILE_TOP_N', DEFAULT_TOP_N)))
+    if value is True or str(value).lower() in ['true', 'all', '1']:
+        return list(PROFILERS), top_n
+    if not value or str(value).lower() in ['false', 'none', '0']:
+        return [], top_n
+    if not isinstance(value, list):
+        value = str(value).split(',')
+    enabled = [x.strip().lower() for x in value if x.strip().lower() in PROFILERS]
+    return enabled, top_n
+
+@contextmanager
+def profiled(ctx=None):
+    '''
+    runs the enclosed block under the enabled profilers. Yields a list the caller appends product
+    directories to; on exit the results are written into each of them (or the work dir if none).
+    '''
+    global _thread_profiles
+    enabled, top_n = get_settings(ctx)
+    product_dirs = []
+    if not enabled:
+        yield product_dirs
+        return
+    print('profiling enabled: {}'.format(', '.join(enabled)))
+    profiler = None
+    if 'tracemalloc' in enabled:
+        tracemalloc.start(25)
+    if 'cprofile' in enabled:
+        profiler = cProfile.Profile()
+        _thread_profiles = []
+        profiler.enable()
+    try:
+        yield product_dirs
+    finally:
+        thread_profiles = []
+        if profiler is not None:
+            profiler.disable()
+            with _lock:
+                thread_profiles, _thread_profiles = _thread_profiles, None
+        snapshot = None
+        peak = 0
+        if 'tracemalloc' in enabled:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        for directory in (product_dirs or ['.']):
+            prefix = os.path.basename(os.path.normpath(directory)) if product_dirs else 'report_profile'
+            if profiler is not None:
+                write_pstats(profiler, thread_profiles, directory, prefix, top_n)
+            if snapshot is not None:
+                write_tracemalloc(snapshot, peak, directory, prefix, top_n)
+
+def threaded(func):
+    '''
+    wraps a function submitted to a thread pool so that, while cProfile is enabled, each call is profiled
+    in its worker thread & merged into the report's stats. cProfile only sees the thread that enabled it
+    '''
+    def wrapper(*args, **kwargs):
+        if (_thread_profiles is None or getattr(_local, 'profiling', False)
+                or threading.current_thread() is threading.main_thread()): # off, or already profiled
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        _local.profiling = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _local.profiling = False
+            with _lock:
+                if _thread_profiles is not None:
+                    _thread_profiles.append(profiler)
+    return wrapper
+
+def write_pstats(profiler, thread_profiles, directory, prefix, top_n):
+    '''writes the binary pstats, merged with those of the profiled threads, & a text summary of the top n
+    functions by cumulative time'''
+    outpath = os.path.join(directory, '{}.pstats'.format(prefix))
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    for thread_profile in thread_profiles:
+        stats.add(thread_profile)
+    stats.dump_stats(outpath)
+    stats.sort_stats('cumulative').print_stats(top_n)
+    with open(os.path.join(directory, '{}.pstats.txt'.format(prefix)), 'w') as outf:
+        outf.write(stream.getvalue())
+    print('wrote cProfile stats to {}'.format(outpath))
+
+def write_tracemalloc(snapshot, peak, directory, prefix, top_n):
+    '''writes the top n allocation sites of the snapshot'''
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    outpath = os.path.join(directory, '{}.tracemalloc.txt'.format(prefix))
+    with open(outpath, 'w') as outf:
+        outf.write('peak traced memory: {:.1f} MiB\n'.format(peak / (1024.0 * 1024.0)))
+        outf.write('top {} allocation sites by size:\n'.format(top_n))
+        for stat in snapshot.statistics('lineno')[:top_n]:
+            outf.write('{}\n'.format(stat))
+    print('wrote tracemalloc snapshot to {}'.format(outpath))
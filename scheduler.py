@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+'''
+Runs the fetches of a track as a small dependency graph. Every task starts on a shared thread pool as
+soon as the tasks it depends on have finished, & a task can cancel the rest of the graph (an empty audit
+trail leaves nothing to report). The critical path, the chain of dependent tasks bounding the wall time,
+is reported with the task timings.
+'''
+from __future__ import print_function
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import profiling
+
+SETTINGS = {'fetch_workers': 8} # tasks of a track run concurrently
+
+def configure(ctx=None):
+    '''applies the context, falling back to the environment'''
+    ctx = ctx or {}
+    SETTINGS['fetch_workers'] = int(ctx.get('fetch_workers', os.environ.get('REPORT_FETCH_WORKERS', 8)) or 1)
+    return SETTINGS
+
+class Cancelled(Exception):
+    '''raised inside tasks still running when the graph is cancelled'''
+    pass
+
+class Scheduler(object):
+    '''dependency graph of named tasks, run concurrently in dependency order'''
+    def __init__(self, workers=None):
+        self.workers = max(1, workers or SETTINGS['fetch_workers'])
+        self.tasks = [] # names in the order they were added
+        self.funcs = {}
+        self.depends = {}
+        self.cancel_ifs = {}
+        self.results = {}
+        self.timings = {} # name -> (start, end) offsets from the start of the run
+        self.status = {}
+        self.cancelled = threading.Event()
+        self.started = None
+        self.finished = None
+
+    def add(self, name, func, depends=None, cancel_if=None):
+        '''adds a task. func is called with the results of the depends tasks, in order. If cancel_if returns
+        true for the task's result the graph is cancelled: waiting tasks never start & running ones stop at
+        their next cancellable item'''
+        depends = list(depends or [])
+        unknown = [dep for dep in depends if dep not in self.funcs]
+        if unknown:
+            raise Exception('task {} depends on unknown tasks: {}'.format(name, ', '.join(unknown)))
+        self.tasks.append(name)
+        self.funcs[name] = func
+        self.depends[name] = depends
+        self.cancel_ifs[name] = cancel_if
+        self.status[name] = 'waiting'
+
+    def cancellable(self, iterable):
+        '''yields from the iterable until the graph is cancelled, closing it either way'''
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if self.cancelled.is_set():
+                    raise Cancelled()
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        '''runs the graph & returns the results of the completed tasks by name. Errors of a task cancel the
+        graph & are raised once the running tasks have stopped'''
+        self.started = time.time()
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            while True:
+                if not self.cancelled.is_set():
+                    for name in self.ready():
+                        self.status[name] = 'running'
+                        running[executor.submit(profiling.threaded(self.call), name)] = name
+                if not running:
+                    break
+                done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                        self.status[name] = 'done'
+                        cancel_if = self.cancel_ifs[name]
+                        if cancel_if is not None and not self.cancelled.is_set() and cancel_if(self.results[name]):
+                            print('task {} cancelled the remaining fetches'.format(name))
+                            self.cancel()
+                    except Cancelled:
+                        self.status[name] = 'cancelled'
+                    except Exception as err:
+                        self.status[name] = 'failed'
+                        error = error or err
+                        self.cancel()
+        self.finished = time.time()
+        for name in self.tasks:
+            if self.status[name] == 'waiting':
+                self.status[name] = 'cancelled'
+        if error is not None:
+            raise error
+        return dict(self.results)
+
+    def ready(self):
+        '''waiting tasks whose dependencies are all done'''
+        return [name for name in self.tasks if self.status[name] == 'waiting'
+                and all(self.status[dep] == 'done' for dep in self.depends[name])]
+
+    def call(self, name):
+        start = time.time()
+        try:
+            return self.funcs[name](*[self.results[dep] for dep in self.depends[name]])
+        finally:
+            self.timings[name] = (start - self.started, time.time() - self.started)
+
+    def critical_path(self):
+        '''returns the longest chain of dependent tasks by run time & its duration'''
+        longest = {}
+        for name in self.tasks: # tasks are added after their dependencies
+            start, end = self.timings.get(name, (0.0, 0.0))
+            chain, duration = max([longest[dep] for dep in self.depends[name]] or [([], 0.0)], key=lambda x: x[1])
+            longest[name] = (chain + [name], duration + end - start)
+        if not longest:
+            return [], 0.0
+        return max(list(longest.values()), key=lambda x: x[1])
+
+    def summary(self):
+        '''returns the task timings & critical path as a json serializable dict'''
+        path, duration = self.critical_path()
+        tasks = dict((name, {'status': self.status[name], 'depends': self.depends[name],
+                             'start_s': round(self.timings[name][0], 3) if name in self.timings else None,
+                             'duration_s': round(self.timings[name][1] - self.timings[name][0], 3) if name in self.timings else 0.0})
+                     for name in self.tasks)
+        return {'wall_s': round((self.finished or time.time()) - (self.started or time.time()), 3),
+                'serial_s': round(sum(task['duration_s'] for task in tasks.values()), 3),
+                'critical_path_s': round(duration, 3), 'critical_path': path,
+                'cancelled': self.cancelled.is_set(), 'tasks': tasks}
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+'''
+Memory budget for the per-track product indices. With `memory_budget_mb` set in _context.json (or
+REPORT_MEMORY_BUDGET_MB in the environment), the store_by_* indices of a track are built as SpillDicts:
+plain in-memory dicts until the estimated size of the track's indices crosses the budget, at which point
+the largest index moves to an SQLite file & keeps serving the same lookups from disk.
+'''
+from __future__ import print_function
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+SETTINGS = {'memory_budget_mb': 0, 'spill_dir': ''} # 0 disables the budget, spill_dir defaults to the temp dir
+SAMPLE_SIZE = 100 # values sampled per index to estimate its bytes per item
+CHECK_FRACTION = 16 # the budget is checked each time about 1/CHECK_FRACTION of it has been added
+FETCH_ROWS = 1000 # rows read per fetch when iterating a spilled index
+PY_OVERHEAD = 4.0 # rough ratio of the in-memory size of a decoded document to its json length
+_budget = None
+
+def configure(ctx=None):
+    '''applies the context, falling back to the environment'''
+    ctx = ctx or {}
+    SETTINGS['memory_budget_mb'] = float(ctx.get('memory_budget_mb', os.environ.get('REPORT_MEMORY_BUDGET_MB', 0)) or 0)
+    SETTINGS['spill_dir'] = ctx.get('spill_dir', os.environ.get('REPORT_SPILL_DIR', '')) or ''
+    return SETTINGS
+
+@contextmanager
+def track_index():
+    '''scopes a memory budget to the indices built in the enclosed block & removes their spill files on exit'''
+    global _budget
+    if not SETTINGS['memory_budget_mb']:
+        yield None
+        return
+    _budget = Budget(int(SETTINGS['memory_budget_mb'] * 1024 * 1024), SETTINGS['spill_dir'] or None)
+    try:
+        yield _budget
+    finally:
+        _budget.close()
+        _budget = None
+
+def index():
+    '''returns a new index: a dict, or a SpillDict under the current track's budget'''
+    if _budget is None:
+        return {}
+    return SpillDict(_budget)
+
+def check():
+    '''checks the current track's budget, called once an index is fully built'''
+    if _budget is not None:
+        _budget.check()
+
+class Budget(object):
+    '''tracks the estimated size of a track's indices & spills the largest to disk when over the limit'''
+    def __init__(self, limit_bytes, directory=None):
+        self.limit_bytes = limit_bytes
+        self.directory = tempfile.mkdtemp(prefix='report_spill_', dir=directory)
+        self.indices = []
+        self.lock = threading.RLock() # indices may be built from concurrent fetches
+        self.check_bytes = max(1, limit_bytes // CHECK_FRACTION)
+        self.added_bytes = 0 # estimated bytes added since the last check
+
+    def register(self, spill_dict):
+        with self.lock:
+            self.indices.append(spill_dict)
+            return len(self.indices)
+
+    def estimate(self):
+        return sum(x.estimate() for x in self.indices)
+
+    def add(self, nbytes):
+        '''counts the estimated bytes of an insert, checking the budget once enough have been added'''
+        with self.lock:
+            self.added_bytes += nbytes
+            if self.added_bytes >= self.check_bytes:
+                self.check()
+
+    def check(self):
+        with self.lock:
+            self.added_bytes = 0
+            while self.estimate() > self.limit_bytes:
+                largest = max(self.indices, key=lambda x: x.estimate())
+                if largest.estimate() == 0:
+                    break
+                print('track index estimated at {:.1f} MiB exceeds the {:.1f} MiB memory budget, spilling {} items to disk'.format(
+                    self.estimate() / 1048576.0, self.limit_bytes / 1048576.0, len(largest)))
+                largest.spill(os.path.join(self.directory, 'index_{}.sqlite'.format(largest.number)))
+
+    def close(self):
+        for spill_dict in self.indices:
+            spill_dict.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class SpillDict(object):
+    '''dict-like index (get, [], in, len, keys, values, items, iteration in insertion order) that can move to SQLite'''
+    def __init__(self, budget):
+        self.budget = budget
+        self.number = budget.register(self)
+        self.data = {}
+        self.db = None
+        self.sampled = 0
+        self.sampled_bytes = 0
+
+    def estimate(self):
+        '''estimated in-memory bytes, 0 once spilled'''
+        if self.db is not None or not self.sampled:
+            return 0
+        return len(self.data) * PY_OVERHEAD * self.sampled_bytes / self.sampled
+
+    def spill(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE kv (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.executemany('INSERT INTO kv VALUES (?, ?)', ((key, json.dumps(value)) for key, value in self.data.items()))
+        self.db.commit()
+        self.data = {}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __setitem__(self, key, value):
+        with self.budget.lock:
+            if self.db is not None:
+                encoded = json.dumps(value)
+                if not self.db.execute('UPDATE kv SET value = ? WHERE key = ?', (encoded, key)).rowcount:
+                    self.db.execute('INSERT INTO kv VALUES (?, ?)', (key, encoded))
+                return
+            if self.sampled < SAMPLE_SIZE:
+                self.sampled += 1
+                self.sampled_bytes += len(json.dumps(value))
+            self.data[key] = value
+            self.budget.add(PY_OVERHEAD * self.sampled_bytes / self.sampled)
+
+    def __getitem__(self, key):
+        if self.db is None:
+            return self.data[key]
+        row = self.db.execute('SELECT value FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if self.db is None:
+            return key in self.data
+        return self.db.execute('SELECT 1 FROM kv WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self):
+        if self.db is None:
+            return len(self.data)
+        return self.db.execute('SELECT COUNT(*) FROM kv').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        if self.db is None:
+            return self.data.keys()
+        return [row[0] for row in self.db.execute('SELECT key FROM kv ORDER BY rowid')]
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def items(self):
+        if self.db is None:
+            for item in list(self.data.items()):
+                yield item
+            return
+        cursor = self.db.execute('SELECT key, value FROM kv ORDER BY rowid')
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            for key, value in rows:
+                yield key, json.loads(value)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+'''
+Generates synthetic, internally consistent GRQ corpora (AOI, acquisitions, SLCs, acq-lists, ifg-cfgs,
+GUNWs, audit trails & aoi_tracks) for exercising the reports at controllable sizes
+'''
+from __future__ import print_function
+import json
+import random
+import hashlib
+import argparse
+import datetime
+
+# concrete index names, matching the wildcard patterns in the report IDX_DCTs
+INDICES = {'aoi': 'grq_v3.0_area_of_interest', 'audit_trail': 'grq_v2.0_s1-gunw-acqlist-audit_trail',
+           'ifg': 'grq_v2.0.2_s1-gunw', 'acq-list': 'grq_v2.0_s1-gunw-acq-list', 'ifg-cfg': 'grq_v2.0_s1-gunw-ifg-cfg',
+           'slc': 'grq_v1.1_s1-iw_slc', 'acq': 'grq_v2.0_acquisition-s1-iw_slc', 'aoi_track': 'grq_v2.0_s1-gunw-aoi_track',
+           'greylist': 'grq_v2.0_s1-gunw-greylist', 'blacklist': 'grq_v2.0_s1-gunw-blacklist'}
+DT_FMT = '%Y-%m-%dT%H:%M:%S'
+REPEAT_DAYS = 12
+GUNWS_PER_AOI_TRACK = 50
+
+def generate_corpus(num_acq_lists, aoi_id='AOI_synthetic', tracks=(64,), frames=3, neighbors=3,
+                    missing_slc_rate=0.05, missing_ifg_cfg_rate=0.02, missing_ifg_rate=0.05,
+                    duplicate_rate=0.01, greylist_rate=0.0, blacklist_rate=0.0, seed=0,
+                    start=datetime.datetime(2015, 1, 1)):
+    '''
+    returns a dict of {index_name: [hits]} holding an AOI & roughly num_acq_lists acquisition-lists
+    split across the tracks. Each acquisition date holds `frames` scenes & pairs with its `neighbors`
+    previous dates. missing rates drop the downstream product, duplicate_rate re-ingests
+    acq-lists/ifg-cfgs/GUNWs under a new id with a later creation_timestamp.
+    '''
+    rand = random.Random(seed)
+    corpus = dict((key, []) for key in INDICES)
+    per_track = max(1, int(num_acq_lists // len(tracks)))
+    num_dates = per_track // neighbors + neighbors + 1
+    end = start + datetime.timedelta(days=REPEAT_DAYS * num_dates)
+    location = {'type': 'Polygon', 'coordinates': [[[-120.0, 34.0], [-118.0, 34.0], [-118.0, 36.0], [-120.0, 36.0], [-120.0, 34.0]]]}
+    aoi = hit(aoi_id, {'id': aoi_id, 'dataset_type': 'area_of_interest', 'starttime': start.strftime(DT_FMT),
+                       'endtime': end.strftime(DT_FMT), 'location': location, 'metadata': {}})
+    corpus['aoi'].append(aoi)
+    for track in tracks:
+        gen_track(corpus, rand, aoi_id, track, location, start, per_track, num_dates, frames, neighbors,
+                  missing_slc_rate, missing_ifg_cfg_rate, missing_ifg_rate, duplicate_rate,
+                  greylist_rate, blacklist_rate)
+    return dict((INDICES[key], docs) for key, docs in list(corpus.items()))
+
+def gen_track(corpus, rand, aoi_id, track, location, start, num_acq_lists, num_dates, frames, neighbors,
+              missing_slc_rate, missing_ifg_cfg_rate, missing_ifg_rate, duplicate_rate,
+              greylist_rate, blacklist_rate):
+    '''appends the products of a single track to the corpus'''
+    orbit = 1000 + track
+    scenes_by_date = []
+    for day in range(num_dates):
+        date = start + datetime.timedelta(days=REPEAT_DAYS * day, seconds=track * 60)
+        scenes = []
+        for frame in range(frames):
+            st = date + datetime.timedelta(seconds=25 * frame)
+            et = st + datetime.timedelta(seconds=27)
+            slc_id = 'S1A_IW_SLC__1SDV_{}_{}_{:06d}_{:06X}_{:04X}'.format(st.strftime('%Y%m%dT%H%M%S'), et.strftime('%Y%m%dT%H%M%S'),
+                                                                        orbit + day * 175, rand.randint(0, 0xFFFFFF), rand.randint(0, 0xFFFF))
+            acq_id = 'acquisition-S1A_IW_ACQ__1SDV_{}_{:06d}-esa_scihub'.format(st.strftime('%Y%m%dT%H%M%S'), orbit + day * 175)
+            met = {'title': slc_id, 'identifier': slc_id, 'processing_version': '002.91', 'track_number': track}
+            corpus['acq'].append(hit(acq_id, source(acq_id, st, et, location, met)))
+            if rand.random() >= missing_slc_rate:
+                corpus['slc'].append(hit(slc_id, source(slc_id, st, et, location, {'trackNumber': track})))
+            scenes.append((slc_id, st, et))
+        scenes_by_date.append(scenes)
+    count = 0
+    gunw_ids = []
+    gunw_times = []
+    for ref_idx in range(1, num_dates):
+        for offset in range(1, neighbors + 1):
+            sec_idx = ref_idx - offset
+            if sec_idx < 0 or count >= num_acq_lists:
+                continue
+            count += 1
+            master, slave = scenes_by_date[ref_idx], scenes_by_date[sec_idx]
+            gunw = gen_pair(corpus, rand, aoi_id, track, location, master, slave, missing_ifg_cfg_rate,
+                            missing_ifg_rate, duplicate_rate, greylist_rate, blacklist_rate)
+            if gunw:
+                gunw_ids.append(gunw[0])
+                gunw_times.append(gunw[1])
+    for idx in range(0, len(gunw_ids), GUNWS_PER_AOI_TRACK):
+        aoi_track_id = 'S1-GUNW-AOI_TRACK-{}-TN{:03d}-{:05d}'.format(aoi_id, track, idx // GUNWS_PER_AOI_TRACK)
+        met = {'aoi': aoi_id, 'track_number': track, 's1-gunw-ids': gunw_ids[idx:idx + GUNWS_PER_AOI_TRACK]}
+        ctime = max(gunw_times[idx:idx + GUNWS_PER_AOI_TRACK]) + datetime.timedelta(hours=6)
+        corpus['aoi_track'].append(hit(aoi_track_id, source(aoi_track_id, start, start, location, met, ctime)))
+
+def gen_pair(corpus, rand, aoi_id, track, location, master, slave, missing_ifg_cfg_rate, missing_ifg_rate,
+             duplicate_rate, greylist_rate, blacklist_rate):
+    '''appends the acq-list, audit trail, ifg-cfg & GUNW for a master/slave date. Returns the GUNW id & creation time'''
+    master_ids = [x[0] for x in master]
+    slave_ids = [x[0] for x in slave]
+    id_hash = full_id_hash(master_ids, slave_ids)
+    st, et = slave[0][1], master[-1][2]
+    ref_date, sec_date = master[0][1].strftime('%Y%m%d'), slave[0][1].strftime('%Y%m%d')
+    ctime = et + datetime.timedelta(days=2, seconds=rand.randint(0, 86400))
+    base_met = {'full_id_hash': id_hash, 'track_number': track, 'master_scenes': master_ids, 'slave_scenes': slave_ids,
+                'reference_date': master[0][1].strftime(DT_FMT), 'secondary_date': slave[0][1].strftime(DT_FMT)}
+    pair_id = 'TN{:03d}-{}_{}-{}'.format(track, ref_date, sec_date, id_hash[:8])
+    audit_met = {'full_id_hash': id_hash, 'track_number': track, 'aoi': aoi_id, 'reference_date': base_met['reference_date'],
+                 'secondary_date': base_met['secondary_date'], 'comment': 'passed', 'failure_reason': '',
+                 'reference_scenes': master_ids, 'secondary_scenes': slave_ids, 'union_geojson': location,
+                 'context': {'aoi': aoi_id}}
+    corpus['audit_trail'].append(hit('S1-GUNW-acqlist-audit_trail-' + pair_id, source('S1-GUNW-acqlist-audit_trail-' + pair_id, st, et, location, audit_met, ctime)))
+    add_product(corpus['acq-list'], rand, 'S1-GUNW-acq-list-' + pair_id, st, et, location, base_met, ctime, duplicate_rate)
+    if rand.random() < greylist_rate:
+        corpus['greylist'].append(hit('S1-GUNW-GREYLIST-' + pair_id, source('S1-GUNW-GREYLIST-' + pair_id, st, et, location, {'full_id_hash': id_hash})))
+    elif rand.random() < blacklist_rate:
+        corpus['blacklist'].append(hit('S1-GUNW-BLACKLIST-' + pair_id, source('S1-GUNW-BLACKLIST-' + pair_id, st, et, location, {'full_id_hash': id_hash})))
+    if rand.random() < missing_ifg_cfg_rate:
+        return False
+    ctime += datetime.timedelta(hours=rand.randint(1, 48))
+    add_product(corpus['ifg-cfg'], rand, 'S1-GUNW-ifg-cfg-' + pair_id, st, et, location, base_met, ctime, duplicate_rate)
+    if rand.random() < missing_ifg_rate:
+        return False
+    ctime += datetime.timedelta(hours=rand.randint(2, 96))
+    gunw_id = 'S1-GUNW-D-R-{:03d}-tops-{}_{}-{}-v2_0_2'.format(track, ref_date, sec_date, id_hash[:8])
+    add_product(corpus['ifg'], rand, gunw_id, st, et, location, base_met, ctime, duplicate_rate)
+    return gunw_id, ctime
+
+def add_product(docs, rand, obj_id, st, et, location, met, ctime, duplicate_rate):
+    '''appends the product & (at duplicate_rate) a later re-ingest of it under another id'''
+    docs.append(hit(obj_id, source(obj_id, st, et, location, dict(met), ctime)))
+    if rand.random() < duplicate_rate:
+        dup_id = obj_id + '-dup'
+        docs.append(hit(dup_id, source(dup_id, st, et, location, dict(met), ctime + datetime.timedelta(days=1))))
+
+def hit(obj_id, src):
+    '''wraps a _source in an ES hit'''
+    return {'_id': obj_id, '_score': 1.0, '_source': src}
+
+def source(obj_id, st, et, location, met, ctime=None):
+    '''builds a product _source'''
+    ctime = ctime or et
+    return {'id': obj_id, 'starttime': st.strftime(DT_FMT), 'endtime': et.strftime(DT_FMT), 'location': location,
+            'creation_timestamp': ctime.strftime(DT_FMT), 'metadata': met}
+
+def full_id_hash(master_slcs, slave_slcs):
+    '''copy of hash used in the enumerator'''
+    master_ids_str = ' '.join(sorted(master_slcs))
+    slave_ids_str = ' '.join(sorted(slave_slcs))
+    return hashlib.md5(json.dumps([master_ids_str, slave_ids_str]).encode("utf8")).hexdigest()
+
+def by_type(corpus):
+    '''returns the corpus keyed by object type rather than index name'''
+    names = dict((v, k) for k, v in list(INDICES.items()))
+    return dict((names.get(index, index), docs) for index, docs in list(corpus.items()))
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic GRQ corpus file')
+    parser.add_argument('num_acq_lists', type=int)
+    parser.add_argument('output', help='output json of the form {index_name: [hits]}')
+    parser.add_argument('--tracks', type=int, nargs='+', default=[64])
+    parser.add_argument('--missing-slc-rate', type=float, default=0.05)
+    parser.add_argument('--missing-ifg-cfg-rate', type=float, default=0.02)
+    parser.add_argument('--missing-ifg-rate', type=float, default=0.05)
+    parser.add_argument('--duplicate-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    corpus = generate_corpus(args.num_acq_lists, tracks=args.tracks, missing_slc_rate=args.missing_slc_rate,
+                             missing_ifg_cfg_rate=args.missing_ifg_cfg_rate, missing_ifg_rate=args.missing_ifg_rate,
+                             duplicate_rate=args.duplicate_rate, seed=args.seed)
+    with open(args.output, 'w') as outf:
+        json.dump(corpus, outf)
+    for index in sorted(corpus.keys()):
+        print('{}: {}'.format(index, len(corpus[index])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+'''
+Shared fixtures. The report modules are flat top-level modules, so the repo root is put on the path, &
+fake_grq provides the grq_server fixture.
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+pytest_plugins = ['fake_grq']
+
+@pytest.fixture
+def grq_settings(tmp_path):
+    '''grq with its default settings, a fresh page size cache & no resolved indices'''
+    import grq
+    saved = dict(grq.SETTINGS)
+    grq.SETTINGS['page_size_cache'] = str(tmp_path / 'page_sizes.json')
+    grq._learned_sizes = None
+    grq._resolved.clear()
+    yield grq.SETTINGS
+    grq.SETTINGS.clear()
+    grq.SETTINGS.update(saved)
+    grq._learned_sizes = None
+    grq._resolved.clear()
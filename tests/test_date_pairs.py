@@ -0,0 +1,27 @@
+'''date pair parsing & packing'''
+import pytest
+import date_pairs
+
+REFERENCE = '20200110-20200104'
+
+@pytest.mark.parametrize('value', [
+    '20200110-20200104', '20200104-20200110', '20200110_20200104', ' "20200110-20200104" ',
+    '2020-01-10_2020-01-04', '2020-01-04_2020-01-10',
+    'Jan 10 2020-Jan 4 2020', '2020/01/10-2020/01/04',
+])
+def test_parse_pair_formats(value):
+    assert date_pairs.format_pairs([date_pairs.parse_pair(value)]) == [REFERENCE]
+
+def test_parse_pair_short_dates_use_dateutil():
+    '''YYmmdd pairs, as the submitter placeholder advertises, are read as dateutil reads them'''
+    key = date_pairs.parse_pair('991231-991225')
+    assert date_pairs.format_pairs([key]) == ['19991231-19991225']
+
+@pytest.mark.parametrize('value', ['', 'junk', '20200110', '2020-01-10', '20200110-', 'abc-def', '20201340-20200104',
+                                   '2020-01-10-2020-01-04-2020'])
+def test_parse_pair_rejects(value):
+    assert date_pairs.parse_pair(value) is None
+
+def test_parse_enumeration_sorts_unique_keys():
+    keys = date_pairs.parse_enumeration(['20200110-20200104', '20200104_20200110', 'bad', '20190110-20190104'])
+    assert date_pairs.format_pairs(keys) == ['20190110-20190104', '20200110-20200104']
@@ -0,0 +1,89 @@
+'''behaviour of the grq fetch strategies against the fake_grq stand-in'''
+import datetime
+import pytest
+import grq
+
+INDEX = 'grq_v1.0_s1-iw_slc'
+QUERY = {'query': {'match_all': {}}}
+
+def add_docs(server, count, index=INDEX):
+    server.add(index, [{'_id': 'doc-{:05d}'.format(i), '_source': {'id': 'doc-{:05d}'.format(i)}} for i in range(count)])
+    return '{}/es/{}/_search'.format(server.url, index)
+
+def ids(hits):
+    return [hit['_id'] for hit in hits]
+
+def test_parallel_short_pages_match_page_es(grq_server, grq_settings):
+    '''a cluster capping the page size returns short pages, which must not leave gaps or duplicates'''
+    url = add_docs(grq_server, 2500)
+    grq_server.max_page_size = 300
+    expected = ids(grq.page_es(url, dict(QUERY, size=1000)))
+    plan = {'object_type': 'slc', 'count': 2500, 'strategy': 'parallel', 'page_size': 1000, 'pages': 3}
+    hits = ids(grq.parallel_es(url, QUERY, plan))
+    assert len(expected) == 2500
+    assert hits == expected
+
+def test_sliced_scroll_matches_page_es(grq_server, grq_settings):
+    '''the slices of a scroll together return every hit once, whatever order they are merged in'''
+    url = add_docs(grq_server, 2500)
+    grq_server.max_page_size = 300
+    grq_settings['window_queue_batches'] = 1
+    expected = ids(grq.page_es(url, dict(QUERY, size=1000)))
+    plan = {'object_type': 'slc', 'count': 2500, 'strategy': 'sliced_scroll', 'page_size': 1000, 'pages': 3, 'slices': 3}
+    hits = ids(grq.sliced_scroll_es(url, QUERY, plan))
+    assert sorted(hits) == sorted(expected)
+    assert len(hits) == len(set(hits))
+
+def test_filtered_queries_are_not_sliced(grq_server, grq_settings):
+    '''filtered queries only run on clusters without sliced scroll, so they are planned as a single scroll'''
+    url = add_docs(grq_server, 2500)
+    grq_settings.update(plan_parallel_max=1000, scroll_slices=4, scroll_slice_size=500)
+    filtered = {'query': {'filtered': {'query': {'match_all': {}}}}}
+    assert grq.plan_query(url, filtered, 'slc')['strategy'] == 'scroll'
+    assert grq.plan_query(url, QUERY, 'slc')['strategy'] == 'sliced_scroll'
+
+def test_scroll_matches_page_es(grq_server, grq_settings):
+    url = add_docs(grq_server, 2500)
+    grq_server.max_page_size = 300
+    expected = ids(grq.page_es(url, dict(QUERY, size=1000)))
+    plan = {'object_type': 'slc', 'count': 2500, 'strategy': 'scroll', 'page_size': 1000, 'pages': 3}
+    assert ids(grq.scroll_es(url, QUERY, plan)) == expected
+
+@pytest.mark.parametrize('settings, strategy', [
+    ({}, 'parallel'),
+    ({'plan_parallel_max': 1000}, 'scroll'),
+    ({'plan_parallel_max': 1000, 'scroll_slices': 3, 'scroll_slice_size': 1000}, 'sliced_scroll'),
+])
+def test_planned_strategies_match_page_es(grq_server, grq_settings, settings, strategy):
+    '''whichever strategy the plan picks, a page capped cluster returns every hit exactly once'''
+    url = add_docs(grq_server, 2500)
+    grq_server.max_page_size = 300
+    grq_settings.update(settings)
+    expected = ids(grq.page_es(url, dict(QUERY, size=1000)))
+    assert grq.plan_query(url, dict(QUERY, size=1000), 'slc')['strategy'] == strategy
+    hits = ids(grq.iter_es(url, dict(QUERY, size=1000), 'slc'))
+    assert sorted(hits) == sorted(expected)
+    assert len(hits) == len(set(hits))
+
+def window_query(start, end):
+    return {'query': {'bool': {'must': [{'range': {'endtime': {'gte': start}}}, {'range': {'starttime': {'lte': end}}}]}}}
+
+def test_time_windows_drop_boundary_duplicates(grq_server, grq_settings):
+    '''products spanning a window boundary match both windows but are yielded once, in window order'''
+    days = [datetime.datetime(2020, 1, 1) + datetime.timedelta(days=i) for i in range(60)]
+    grq_server.add(INDEX, [{'_id': 'doc-{:05d}'.format(i), '_source': {
+        'starttime': day.strftime('%Y-%m-%dT%H:%M:%S'),
+        'endtime': (day + datetime.timedelta(days=2)).strftime('%Y-%m-%dT%H:%M:%S')}} for i, day in enumerate(days)])
+    url = '{}/es/{}/_search'.format(grq_server.url, INDEX)
+    grq_settings.update(time_windows='3', window_queue_batches=1)
+    windows = grq.time_windows('2020-01-01T00:00:00', '2020-03-01T00:00:00')
+    assert len(windows) == 3
+    queries = [window_query(start, end) for start, end in windows]
+    per_window = [ids(grq.page_es(url, dict(query, size=1000))) for query in queries]
+    assert sum(len(x) for x in per_window) > 60 # the boundary products are in two windows
+    hits = ids(grq.iter_windows(url, queries, 'slc'))
+    expected = []
+    for window in per_window:
+        expected.extend(x for x in window if x not in expected)
+    assert hits == expected
+    assert sorted(hits) == ['doc-{:05d}'.format(i) for i in range(60)]
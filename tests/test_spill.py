@@ -0,0 +1,47 @@
+'''SpillDict spilling to SQLite under a memory budget & reading back'''
+import os
+import spill
+
+def doc(i):
+    return {'_id': 'doc-{:05d}'.format(i), '_source': {'id': 'doc-{:05d}'.format(i), 'payload': 'x' * 200}}
+
+def test_spill_dict_reads_back_after_spilling(tmp_path):
+    budget = spill.Budget(64 * 1024, str(tmp_path))
+    index = spill.SpillDict(budget)
+    for i in range(500):
+        index[doc(i)['_id']] = doc(i)
+    assert index.db is not None # the budget was crossed while inserting
+    assert len(index) == 500
+    assert index['doc-00042'] == doc(42)
+    assert index.get('doc-99999') is None
+    assert 'doc-00499' in index and 'doc-99999' not in index
+    assert list(index.keys()) == [doc(i)['_id'] for i in range(500)]
+    assert [value['_id'] for value in index.values()] == list(index.keys())
+    index['doc-00042'] = {'replaced': True}
+    index['doc-00500'] = doc(500)
+    assert index['doc-00042'] == {'replaced': True}
+    assert len(index) == 501
+    budget.close()
+    assert not os.path.exists(budget.directory)
+
+def test_build_ends_with_a_budget_check(tmp_path):
+    '''inserts made since the last check are still checked once the index is built'''
+    spill.configure({'memory_budget_mb': 0.05, 'spill_dir': str(tmp_path)})
+    try:
+        with spill.track_index() as budget:
+            budget.check_bytes = float('inf') # the build ends before the next insert check
+            index = spill.index()
+            for i in range(200):
+                index[doc(i)['_id']] = doc(i)
+            assert index.db is None and budget.estimate() > budget.limit_bytes
+            spill.check()
+            assert index.db is not None
+            assert dict(index.items()) == dict((doc(i)['_id'], doc(i)) for i in range(200))
+    finally:
+        spill.configure({})
+
+def test_no_budget_builds_dicts():
+    spill.configure({})
+    with spill.track_index() as budget:
+        assert budget is None
+        assert spill.index() == {}
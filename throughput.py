@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+Production throughput of the ops report: daily counts of the acq-lists, ifg-cfgs & GUNWs created on a
+track, binned from the creation_timestamps of the indexed products with numpy, or from ES date_histogram
+aggregations in `aggregation` mode, with a compact PNG chart of the cumulative counts.
+'''
+from __future__ import print_function
+import os
+import numpy as np
+import latency
+
+SETTINGS = {'mode': 'products'} # products: bin the fetched products, aggregation: ES date_histogram
+OBJECT_TYPES = [('acq-list', 'acq-lists'), ('ifg-cfg', 'ifg-cfgs'), ('ifg', 'GUNWs')]
+
+def configure(ctx=None):
+    '''applies the context, falling back to the environment'''
+    ctx = ctx or {}
+    mode = ctx.get('throughput_mode', os.environ.get('REPORT_THROUGHPUT_MODE', 'products')) or 'products'
+    if mode not in ['products', 'aggregation']:
+        raise Exception('invalid throughput_mode: {}. Valid modes are: products, aggregation'.format(mode))
+    SETTINGS['mode'] = mode
+    return SETTINGS
+
+def daily_counts(objs):
+    '''returns {YYYY-MM-DD: count} of the objects' creation_timestamps'''
+    times = latency.creation_times(objs)
+    days, counts = np.unique(times[~np.isnat(times)].astype('datetime64[D]'), return_counts=True)
+    return dict((str(day), int(count)) for day, count in zip(days, counts))
+
+def date_histogram(es_query):
+    '''returns the query as a size 0 query with a daily date_histogram of creation_timestamp'''
+    return {'query': es_query['query'], 'size': 0,
+            'aggs': {'daily': {'date_histogram': {'field': 'creation_timestamp', 'interval': 'day',
+                                                  'format': 'yyyy-MM-dd', 'min_doc_count': 1}}}}
+
+def histogram_counts(results):
+    '''returns {YYYY-MM-DD: count} from the buckets of a date_histogram response'''
+    buckets = results.get('aggregations', {}).get('daily', {}).get('buckets', [])
+    return dict((bucket.get('key_as_string', '')[:10], bucket.get('doc_count', 0)) for bucket in buckets if bucket.get('doc_count', 0))
+
+def series(counts):
+    '''
+    takes {object type: {day: count}} & returns a row per day from the first to the last day with any
+    product: [day, count per OBJECT_TYPES..., backlog], where backlog is the acq-lists created to date
+    without a GUNW created to date
+    '''
+    days = sorted(set(day for by_day in counts.values() for day in by_day))
+    if not days:
+        return []
+    dates = np.arange(np.datetime64(days[0]), np.datetime64(days[-1]) + np.timedelta64(1, 'D'))
+    columns = []
+    for object_type, _ in OBJECT_TYPES:
+        by_day = counts.get(object_type, {})
+        columns.append(np.array([by_day.get(str(day), 0) for day in dates], dtype=np.int64))
+    backlog = np.cumsum(columns[0]) - np.cumsum(columns[-1])
+    return [[str(day)] + [int(column[idx]) for column in columns] + [int(backlog[idx])] for idx, day in enumerate(dates)]
+
+def write_chart(path, rows, title):
+    '''writes a PNG of the cumulative counts per object type. Skipped if matplotlib is unavailable'''
+    if not rows:
+        return False
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed, skipping the throughput chart')
+        return False
+    dates = np.array([row[0] for row in rows], dtype='datetime64[D]').astype(object)
+    fig, ax = plt.subplots(figsize=(8, 3), dpi=100)
+    for idx, (_, label) in enumerate(OBJECT_TYPES):
+        ax.step(dates, np.cumsum([row[idx + 1] for row in rows]), where='post', label=label, linewidth=1)
+    ax.set_title(title, fontsize=9)
+    ax.set_ylabel('created to date', fontsize=8)
+    ax.tick_params(labelsize=7)
+    ax.legend(fontsize=7, loc='upper left')
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+    return path